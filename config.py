@@ -20,6 +20,11 @@ TRIGGERS_FILE = DATA_DIR / 'triggers.json'
 BANNED_USERS_FILE = DATA_DIR / 'banned_users.json'
 BACKUP_DIR = BASE_DIR / 'backups'
 
+# Хранить эксклюзивную блокировку БД всё время работы бота (DB_EXCLUSIVE_LOCK=1).
+# По умолчанию выключено: с блокировкой ни один другой процесс (check_schema.py,
+# utils/migrate_database.py, резервное копирование) не сможет открыть базу.
+DB_EXCLUSIVE_LOCK = os.getenv('DB_EXCLUSIVE_LOCK', '0') == '1'
+
 # Ensure data directory exists
 DATA_DIR.mkdir(exist_ok=True)
 BACKUP_DIR.mkdir(exist_ok=True)
@@ -1,7 +1,7 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions, MessageEntity, ChatMember, Message, MessageOriginChannel, User, Chat
 from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler, MessageHandler, filters, Application, ChatMemberHandler
-from telegram.ext.filters import BaseFilter
+from telegram.ext.filters import MessageFilter
 from telegram.constants import ParseMode, ChatType
 from config import MESSAGES, ADMIN_IDS, BACKUP_DIR, AVATAR_HASH_THRESHOLD
 from utils.database import db
@@ -14,8 +14,8 @@ from datetime import datetime, timedelta, time
 from typing import Dict, Optional, List, Tuple, Any
 from handlers.helpers import resolve_target_user, can_moderate_user, delete_cached_messages
 from utils.helpers import schedule_message_deletion, is_admin, is_global_admin, add_bot_message_to_cache
-from handlers.permissions import PERMS_UNRESTRICTED, PERMS_FULL_RESTRICT
-from utils.image_utils import calculate_phash, compare_phashes
+from handlers.permissions import perms, PERMS_UNRESTRICTED_MASK, PERMS_FULL_RESTRICT_MASK
+from utils.image_utils import calculate_phash, find_similar_phash
 from io import BytesIO
 from utils.text_utils import normalize_text
 from utils.cleanup_backups import cleanup_old_backups
@@ -31,12 +31,17 @@ support_messages: Dict[int, Dict] = {}
 # Store admin chat IDs for support messages
 admin_chat_ids = set(ADMIN_IDS) if ADMIN_IDS else set()
 
+# Free pages returned to the OS per hourly incremental vacuum run
+VACUUM_PAGES_PER_RUN = 1000
+
 # To track repetitive messages for anti-spam
 user_message_history: Dict[int, Dict[int, List[Tuple[float, str]]]] = {} # chat_id -> user_id -> [(timestamp, text)]
 
 # Custom filter for messages sent from a linked channel.
 # This is more robust across PTB versions than relying on a constant that might be missing.
-class _SenderChatFilter(BaseFilter):
+# Must be a MessageFilter: BaseFilter.check_update never calls filter(), so a BaseFilter
+# subclass matched every message and shadowed the group-0 moderation handler.
+class _SenderChatFilter(MessageFilter):
     """Filters for messages sent on behalf of a channel."""
     def filter(self, message: Message) -> bool:
         return message and message.sender_chat is not None
@@ -950,7 +955,7 @@ async def handle_banned_avatar_photo(update: Update, context: ContextTypes.DEFAU
         await photo_file.download_to_memory(photo_bytes_io)
         photo_bytes = photo_bytes_io.getvalue()
         
-        phash = await calculate_phash(photo_bytes)
+        phash = await calculate_phash(photo_bytes, file_unique_id)
         
         if not phash:
             await update.message.reply_text("❌ Не удалось обработать изображение для создания хэша.")
@@ -969,21 +974,22 @@ async def handle_banned_avatar_photo(update: Update, context: ContextTypes.DEFAU
             )
             return
 
-        # Check if a similar avatar is banned by phash
-        banned_avatars = db.get_banned_avatars()
-        for banned_avatar in banned_avatars:
-            if banned_avatar.get('phash') and compare_phashes(phash, banned_avatar['phash'], threshold=AVATAR_HASH_THRESHOLD):
-                file_unique_id_to_unban = banned_avatar['file_unique_id']
-                keyboard = [[
-                    InlineKeyboardButton("Да, убрать из бана", callback_data=f"unban_avatar_confirm_{file_unique_id_to_unban}"),
-                    InlineKeyboardButton("Отмена", callback_data="unban_avatar_cancel"),
-                ]]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text(
-                    "ℹ️ Похожая аватарка уже находится в списке запрещенных. Хотите убрать ее?",
-                    reply_markup=reply_markup
-                )
-                return
+        # Check if a similar avatar is banned by phash: match against the cached ints,
+        # then fetch only the matching record
+        banned_hash = find_similar_phash(phash, db.get_all_banned_avatar_hashes_packed(), AVATAR_HASH_THRESHOLD)
+        banned_avatar = db.get_banned_avatar_by_phash(banned_hash) if banned_hash is not None else None
+        if banned_avatar:
+            file_unique_id_to_unban = banned_avatar['file_unique_id']
+            keyboard = [[
+                InlineKeyboardButton("Да, убрать из бана", callback_data=f"unban_avatar_confirm_{file_unique_id_to_unban}"),
+                InlineKeyboardButton("Отмена", callback_data="unban_avatar_cancel"),
+            ]]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await update.message.reply_text(
+                "ℹ️ Похожая аватарка уже находится в списке запрещенных. Хотите убрать ее?",
+                reply_markup=reply_markup
+            )
+            return
 
         # If not banned, add it
         if db.add_banned_avatar(file_unique_id, file_id, phash, admin_id):
@@ -1106,7 +1112,8 @@ async def backup_database(update: Update, context: ContextTypes.DEFAULT_TYPE):
         backup_filename = f"backup_{source_db_path.stem}_{timestamp}{source_db_path.suffix}"
         backup_filepath = BACKUP_DIR / backup_filename
 
-        # 3. Copy the database file
+        # 3. Copy the database file (after moving WAL contents into it)
+        db.checkpoint()
         shutil.copyfile(source_db_path, backup_filepath)
 
         # 4. Send the backup file
@@ -1247,7 +1254,8 @@ async def scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
         backup_filename = f"backup_{source_db_path.stem}_{timestamp}{source_db_path.suffix}"
         backup_filepath = BACKUP_DIR / backup_filename
 
-        # 3. Copy the database file
+        # 3. Copy the database file (after moving WAL contents into it)
+        db.checkpoint()
         shutil.copyfile(source_db_path, backup_filepath)
 
         # 4. Send the backup file to all admins
@@ -1285,6 +1293,10 @@ async def scheduled_backup(context: ContextTypes.DEFAULT_TYPE):
                 except Exception as admin_e:
                     logger.error(f"Failed to send backup error notification to admin {admin_id}: {admin_e}")
 
+async def scheduled_vacuum(context: ContextTypes.DEFAULT_TYPE):
+    """Reclaims free pages left by deleted rows in small steps."""
+    db.incremental_vacuum(VACUUM_PAGES_PER_RUN)
+
 async def global_ban_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles the confirmation callback for a global ban."""
     query = update.callback_query
@@ -1796,7 +1808,7 @@ async def unmute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # Restore default permissions for a member by setting all to True, except for admin-like ones
         await context.bot.restrict_chat_member(
-            chat_id=update.effective_chat.id, user_id=target_user.id, permissions=PERMS_UNRESTRICTED
+            chat_id=update.effective_chat.id, user_id=target_user.id, permissions=perms(PERMS_UNRESTRICTED_MASK)
         )
         
         user_mention_html = target_user.mention_html()
@@ -2317,6 +2329,7 @@ async def reload_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         checked = 0
         banned = 0
+        checked_ids = []  # written with one mark_users_profile_checked call
         
         for m in known:
             user_id = m['user_id']
@@ -2329,7 +2342,7 @@ async def reload_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 member = await context.bot.get_chat_member(chat_id, user_id)
                 if member.status in [ChatMember.ADMINISTRATOR, ChatMember.CREATOR]:
                     checked += 1
-                    db.mark_user_profile_checked(chat_id, user_id) # Mark admin as checked to not see them again
+                    checked_ids.append(user_id) # Mark admin as checked to not see them again
                     continue
             except Exception:
                 pass # Если проверка не удалась, продолжаем. Бан все равно не сработает, если он админ.
@@ -2351,7 +2364,7 @@ async def reload_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
             checked += 1
             # Mark user as checked so we don't check them again
-            db.mark_user_profile_checked(chat_id, user_id)
+            checked_ids.append(user_id)
             
             # Прогресс раз в 10 итераций или на последнем
             if checked % 10 == 0 or checked == total_members:
@@ -2363,6 +2376,8 @@ async def reload_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 except Exception as e:
                     logger.debug(f"Progress update failed: {e}")
         
+        db.mark_users_profile_checked(chat_id, checked_ids)
+        
         # Финальный итог
         if message:
             await message.edit_text(
@@ -2426,12 +2441,13 @@ async def scheduled_name_check(context: ContextTypes.DEFAULT_TYPE):
             logger.info(f"Found {len(unchecked_members)} unchecked members in chat {chat_id}.")
             
             banned_count = 0
+            checked_ids = []  # written with one mark_users_profile_checked call per chat
             for member_data in unchecked_members:
                 user_id = member_data['user_id']
                 
                 # Skip global admins, but mark them as checked
                 if user_id in ADMIN_IDS:
-                    db.mark_user_profile_checked(chat_id, user_id)
+                    checked_ids.append(user_id)
                     continue
 
                 banned_now = False
@@ -2448,9 +2464,11 @@ async def scheduled_name_check(context: ContextTypes.DEFAULT_TYPE):
                             banned_count += 1
                             break 
                 
-                db.mark_user_profile_checked(chat_id, user_id)
+                checked_ids.append(user_id)
                 await asyncio.sleep(0.1) # small delay to avoid hitting limits
 
+            db.mark_users_profile_checked(chat_id, checked_ids)
+
             if banned_count > 0:
                 logger.info(f"Scheduled name check in chat {chat_id} finished. Banned {banned_count} users.")
 
@@ -2644,7 +2662,7 @@ async def link_moderation_callback(update: Update, context: ContextTypes.DEFAULT
     elif action == "unmute":
         try:
             # Снимаем ограничения
-            await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=PERMS_UNRESTRICTED)
+            await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=perms(PERMS_UNRESTRICTED_MASK))
             # Добавляем пользователя в белый список
             db.add_whitelist_user(chat_id, user_id, admin_user.id)
             
@@ -2870,6 +2888,14 @@ def register_admin_handlers(application: Application):
     )
     logger.info("Scheduled daily backup cleanup job.")
 
+    # Reclaim free pages every hour instead of running a full VACUUM
+    application.job_queue.run_repeating(
+        scheduled_vacuum,
+        interval=timedelta(hours=1),
+        name="incremental_vacuum"
+    )
+    logger.info("Scheduled hourly incremental vacuum job.")
+
     # Schedule daily moderation report
     # Запускается раз в день в 08:00 по UTC.
     application.job_queue.run_daily(
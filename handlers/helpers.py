@@ -1,6 +1,7 @@
 import logging
+import time
 from typing import Optional, Tuple, Dict, List
-from telegram import Update, User
+from telegram import Bot, Update, User
 from telegram.ext import ContextTypes
 from config import ADMIN_IDS
 
@@ -88,3 +89,37 @@ async def delete_cached_messages(context: ContextTypes.DEFAULT_TYPE, chat_id: in
             await context.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
         except Exception as e:
             logger.warning(f"Could not bulk-delete cached messages for user {user_id}. It's possible they were already deleted. Error: {e}")
+
+# --- Member Status Cache ---
+# (chat_id, user_id) -> (status, expires_at)
+_member_status_cache: Dict[Tuple[int, int], Tuple[str, float]] = {}
+MEMBER_STATUS_CACHE_TTL = 60  # Seconds before a cached status is re-fetched from the API
+MEMBER_STATUS_CACHE_SIZE = 5000  # Max (chat, user) pairs kept in memory
+
+def get_cached_member_status(chat_id: int, user_id: int) -> Optional[str]:
+    """Returns the cached chat member status, or None if it is missing or expired."""
+    entry = _member_status_cache.get((chat_id, user_id))
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return None
+
+async def get_member_status(bot: Bot, chat_id: int, user_id: int) -> str:
+    """
+    Returns the user's status in the chat, querying the Bot API only on a cache miss.
+    API errors are propagated to the caller.
+    """
+    status = get_cached_member_status(chat_id, user_id)
+    if status is not None:
+        return status
+
+    member = await bot.get_chat_member(chat_id, user_id)
+    key = (chat_id, user_id)
+    if len(_member_status_cache) >= MEMBER_STATUS_CACHE_SIZE and key not in _member_status_cache:
+        # Drop the oldest entry to keep memory bounded
+        del _member_status_cache[next(iter(_member_status_cache))]
+    _member_status_cache[key] = (member.status, time.monotonic() + MEMBER_STATUS_CACHE_TTL)
+    return member.status
+
+def invalidate_member_status(chat_id: int, user_id: int):
+    """Forgets the cached status, e.g. after a chat_member update."""
+    _member_status_cache.pop((chat_id, user_id), None)
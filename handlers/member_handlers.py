@@ -16,12 +16,13 @@ from telegram.ext import (CallbackQueryHandler, ChatMemberHandler,
 # Local application imports
 from config import (ADMIN_IDS, AVATAR_HASH_THRESHOLD, MODERATE_ADMINS,
                     MODERATE_BOTS)
-from handlers.helpers import delete_cached_messages, add_user_message_id
-from handlers.permissions import (PERMS_FULL_RESTRICT, PERMS_MEDIA_RESTRICT,
-                                  PERMS_UNRESTRICTED)
+from handlers.helpers import (delete_cached_messages, add_user_message_id,
+                             get_member_status, invalidate_member_status)
+from handlers.permissions import (PERMS_FULL_RESTRICT_MASK, PERMS_MEDIA_RESTRICT_MASK,
+                                  PERMS_UNRESTRICTED_MASK, perms)
 from utils.database import db
 from utils.helpers import schedule_message_deletion
-from utils.image_utils import calculate_phash, compare_phashes
+from utils.image_utils import calculate_phash, find_similar_phash, get_cached_phash
 from utils.notifications import propose_global_ban
 from utils.text_utils import normalize_text
 
@@ -43,9 +44,7 @@ AVATAR_CHECK_COOLDOWN = 300  # 5 minutes
 # Cache to avoid checking the same user's bio too frequently
 bio_check_cache: Dict[int, float] = {}
 BIO_CHECK_COOLDOWN = 300  # 5 minutes
-
-# Cache to store phash results for a given file_unique_id to avoid re-downloads
-user_avatar_phash_cache: Dict[str, str] = {}
+MEMBER_FLUSH_INTERVAL = 2  # seconds between writes of buffered member updates
 
 # This function is used by other modules
 async def check_user_avatar(chat_id: int, user_id: int, context: ContextTypes.DEFAULT_TYPE, update: Optional[Update] = None) -> bool:
@@ -81,9 +80,9 @@ async def check_user_avatar(chat_id: int, user_id: int, context: ContextTypes.DE
                     logger.warning(f"Failed to delete message for user {user_id} with banned avatar: {e}")
             return await _ban_for_profile_violation(context, chat_id, user_id, "запрещенная аватарка (точное совпадение)")
 
-        # 2. Check our in-memory cache for the phash of this specific avatar file
-        if current_avatar_id in user_avatar_phash_cache:
-            current_phash = user_avatar_phash_cache[current_avatar_id]
+        # 2. Check the phash LRU for this specific avatar file to avoid re-downloads
+        current_phash = get_cached_phash(current_avatar_id)
+        if current_phash:
             logger.debug(f"Found cached phash for avatar {current_avatar_id}: {current_phash}")
         else:
             # 3. If not cached, download and calculate the hash
@@ -93,31 +92,27 @@ async def check_user_avatar(chat_id: int, user_id: int, context: ContextTypes.DE
             await photo_file.download_to_memory(photo_bytes_io)
             photo_bytes = photo_bytes_io.getvalue()
             
-            current_phash = await calculate_phash(photo_bytes)
-            if current_phash:
-                # Store the calculated hash in our cache to avoid future downloads for this file
-                user_avatar_phash_cache[current_avatar_id] = current_phash
+            # Memoized under the file_unique_id to avoid future downloads for this file
+            current_phash = await calculate_phash(photo_bytes, current_avatar_id)
 
         if not current_phash:
             return False # Could not hash the image
 
-        # Get all banned hashes from DB
-        banned_hashes = db.get_all_banned_avatar_hashes()
-        # Compare current hash with all banned hashes
-        for banned_hash in banned_hashes:
-            # The threshold can be adjusted. Lower is stricter. 5 is a reasonable default.
-            if compare_phashes(current_phash, banned_hash, threshold=AVATAR_HASH_THRESHOLD):
-                logger.info(
-                    f"Banning user {user_id} in chat {chat_id} for banned avatar "
-                    f"(similar hash match: current={current_phash}, banned={banned_hash})."
-                )
-                # Если мы находимся в контексте сообщения, удаляем его
-                if update and update.message:
-                    try:
-                        await update.message.delete()
-                    except Exception as e:
-                        logger.warning(f"Failed to delete message for user {user_id} with banned avatar: {e}")
-                return await _ban_for_profile_violation(context, chat_id, user_id, "запрещенная аватарка (схожее изображение)")
+        # Compare current hash with all banned hashes (pre-decoded to ints and cached by db)
+        # The threshold can be adjusted. Lower is stricter. 5 is a reasonable default.
+        banned_hash = find_similar_phash(current_phash, db.get_all_banned_avatar_hashes_packed(), AVATAR_HASH_THRESHOLD)
+        if banned_hash is not None:
+            logger.info(
+                f"Banning user {user_id} in chat {chat_id} for banned avatar "
+                f"(similar hash match: current={current_phash}, banned={banned_hash:016x})."
+            )
+            # Если мы находимся в контексте сообщения, удаляем его
+            if update and update.message:
+                try:
+                    await update.message.delete()
+                except Exception as e:
+                    logger.warning(f"Failed to delete message for user {user_id} with banned avatar: {e}")
+            return await _ban_for_profile_violation(context, chat_id, user_id, "запрещенная аватарка (схожее изображение)")
 
     except Exception as e:
         # This can fail if the user has privacy settings, etc.
@@ -222,7 +217,7 @@ async def check_user_bio(chat_id: int, user_id: int, context: ContextTypes.DEFAU
                     await context.bot.restrict_chat_member(
                         chat_id=chat_id,
                         user_id=user_id,
-                        permissions=PERMS_FULL_RESTRICT
+                        permissions=perms(PERMS_FULL_RESTRICT_MASK)
                     )
                     logger.info(f"Fully restricted user {user_id} in chat {chat_id} for link in bio.")
                 except Exception as e:
@@ -372,8 +367,8 @@ async def check_message_username(update: Update, context: ContextTypes.DEFAULT_T
     # This makes profile checks consistent with message content checks.
     if not MODERATE_ADMINS:
         try:
-            member = await context.bot.get_chat_member(chat_id, user.id)
-            if member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
+            status = await get_member_status(context.bot, chat_id, user.id)
+            if status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
                 raise ApplicationHandlerStop # Stop processing in this group, but allow other groups
         except Exception as e:
             # If check fails, proceed. Ban will likely fail if they are an admin.
@@ -423,7 +418,7 @@ async def lift_media_restriction_job(context: ContextTypes.DEFAULT_TYPE):
             await context.bot.restrict_chat_member(
                 chat_id=chat_id,
                 user_id=user_id,
-                permissions=PERMS_UNRESTRICTED
+                permissions=perms(PERMS_UNRESTRICTED_MASK)
             )
             logger.info(f"Automatically lifted media restrictions for user {user_id} in chat {chat_id}.")
     except Exception as e:
@@ -524,7 +519,7 @@ async def greet_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if is_captcha_enabled:
             # Full restriction pending captcha
             try:
-                await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=PERMS_FULL_RESTRICT)
+                await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=perms(PERMS_FULL_RESTRICT_MASK))
                 logger.info(f"Fully restricted new user {user.id} in chat {chat_id} pending captcha.")
             except Exception as e:
                 logger.error(f"Failed to restrict new user {user.id} for captcha in chat {chat_id}: {e}")
@@ -532,7 +527,7 @@ async def greet_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
         else:
             # Media restriction for 30 minutes
             try:
-                await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=PERMS_MEDIA_RESTRICT)
+                await context.bot.restrict_chat_member(chat_id=chat_id, user_id=user.id, permissions=perms(PERMS_MEDIA_RESTRICT_MASK))
                 logger.info(f"Media-restricted new user {user.id} in chat {chat_id} for 30 minutes.")
             except Exception as e:
                 logger.error(f"Failed to apply media restriction for new user {user.id} in chat {chat_id}: {e}")
@@ -638,7 +633,7 @@ async def verify_member_callback(update: Update, context: ContextTypes.DEFAULT_T
     chat_id = query.message.chat_id
     try:
         # Use the same permissions as unmute to restore full access
-        await context.bot.restrict_chat_member(chat_id=chat_id, user_id=clicker_id, permissions=PERMS_UNRESTRICTED)
+        await context.bot.restrict_chat_member(chat_id=chat_id, user_id=clicker_id, permissions=perms(PERMS_UNRESTRICTED_MASK))
         logger.info(f"User {clicker_id} passed verification in chat {chat_id}.")
 
         # Remove the scheduled kick job
@@ -672,6 +667,9 @@ async def combined_member_update_handler(update: Update, context: ContextTypes.D
     new_member = update.chat_member.new_chat_member
     old_member = update.chat_member.old_chat_member
 
+    # The member's status has changed, so any cached admin status is stale
+    invalidate_member_status(chat_id, user.id)
+
     # --- Case 1: User is leaving or was kicked ---
     if new_member.status in ("left", "kicked"):
         db.mark_left(chat_id, user.id)
@@ -706,8 +704,15 @@ async def combined_member_update_handler(update: Update, context: ContextTypes.D
             for val in filter(None, names_to_check):
                 if await check_username(chat_id, user.id, val, context, update): break
 
+async def _flush_members_job(context: ContextTypes.DEFAULT_TYPE):
+    """Writes buffered known-member updates and queued writes (mark_left etc.) to the database."""
+    db.flush_writes()
+
 def register_member_handlers(application):
     """Register member-related handlers."""
+    # db.upsert_member/db.mark_left only buffer; this job writes them in batches
+    application.job_queue.run_repeating(_flush_members_job, interval=MEMBER_FLUSH_INTERVAL, name="members-flush")
+
     # A single, combined handler for all membership changes (join, leave, update)
     application.add_handler(ChatMemberHandler(combined_member_update_handler, ChatMemberHandler.CHAT_MEMBER))
     
@@ -4,15 +4,18 @@ import re
 import asyncio
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
-from handlers.helpers import add_user_message_id, delete_cached_messages, resolve_target_user
+from handlers.helpers import (
+    add_user_message_id, delete_cached_messages, resolve_target_user,
+    get_cached_member_status, get_member_status
+)
 from telegram import Update, Message, MessageEntity, ChatPermissions, User, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, MessageHandler, filters, ApplicationHandlerStop
 from telegram.constants import ParseMode, ChatType
 from utils.database import db
 from utils.text_utils import normalize_text, is_zalgo_text
-from utils.helpers import schedule_message_deletion, is_admin, add_bot_message_to_cache, bot_message_cache
+from utils.helpers import schedule_message_deletion, is_admin, add_bot_message_to_cache, bot_message_cache, LRUDict
 from utils.notifications import propose_global_ban
-from handlers.permissions import PERMS_FULL_RESTRICT
+from handlers.permissions import perms, PERMS_FULL_RESTRICT_MASK
 from config import (
     MESSAGES, MESSAGE_LIMIT, TIME_WINDOW,
     MAX_WARNINGS, MUTE_DURATION_MINUTES, CAPS_THRESHOLD,
@@ -21,7 +24,7 @@ from config import (
 )
 import re
 import asyncio
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -30,15 +33,41 @@ logger = logging.getLogger(__name__)
 user_moderation_tracker: Dict[tuple, Dict] = {}
 MAX_HISTORY_USERS = 1000  # Limit the number of users in history to prevent memory exhaustion
 
-# Track banned words checks
-BANNED_WORDS_CACHE = {}
-BANNED_WORDS_LAST_UPDATE = 0
-BANNED_WORDS_UPDATE_INTERVAL = 300  # 5 minutes in seconds
+# Compiled banned-words regex per chat: chat_id -> (ban words version, pattern)
+BANNED_WORDS_CACHE: Dict[int, Tuple[int, Optional[re.Pattern]]] = {}
 
 # Message deletion settings
 DELETE_AFTER_SECONDS = 5  # Default time after which to delete messages
 SPAM_WINDOW_SECONDS = 60 # Time window for spam check
 
+# Max replied-to messages remembered per chat to prevent repeated karma
+KARMA_CACHE_SIZE = 512
+# Replies that give karma (compared after normalize_text)
+KARMA_WORDS = frozenset(('+', 'спасибо', 'дякую', 'thanks'))
+KARMA_WORD_MAX_LEN = 32
+# Seconds between writes of buffered karma changes
+KARMA_FLUSH_INTERVAL = 0.5
+# Seconds to wait for the karma notification to be sent
+KARMA_NOTIFY_TIMEOUT = 5.0
+
+# Фильтр для обычных пользователей (не админов).
+# Используется для основного обработчика модерации.
+# MessageFilter, а не BaseFilter: BaseFilter.check_update не вызывает filter().
+class NonAdminFilter(filters.MessageFilter):
+    # Config flag bound as a default argument: a local lookup instead of a global one
+    def filter(self, message: Message, *, _moderate_admins: bool = MODERATE_ADMINS) -> bool:
+        if not message.from_user or not message.chat:
+            return False
+        # Пропускаем, если модерация админов выключена и пользователь - админ.
+        # Фильтры PTB синхронные, поэтому смотрим только в кеш статусов;
+        # при промахе кеша check_user_message сам запросит статус через API.
+        if not _moderate_admins:
+            status = get_cached_member_status(message.chat.id, message.from_user.id)
+            return status not in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]
+        return True
+
+non_admin_filter = NonAdminFilter()
+
 async def _handle_zalgo_violation(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -321,19 +350,28 @@ async def _handle_mimicking_violation(
         add_bot_message_to_cache(chat_id, sent_msg.text)
         schedule_message_deletion(context.job_queue, chat_id, sent_msg.message_id, delay=15)
 
-async def _check_bot_mimicking(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, message_text: str) -> bool:
-    """Checks if a user is repeating a recent bot message."""
-    if not message_text or not (recent_bot_messages := bot_message_cache.get(update.effective_chat.id)):
+async def _check_bot_mimicking(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, normalized_text: str) -> bool:
+    """Checks if a user is repeating a recent bot message. Expects already normalized text."""
+    if not normalized_text or not (recent_bot_messages := bot_message_cache.get(update.effective_chat.id)):
         return False
 
-    if normalize_text(message_text) in recent_bot_messages:
+    if normalized_text in recent_bot_messages:
         await update.message.delete()
         await _handle_mimicking_violation(update, context, update.effective_user, update.effective_chat.id)
         return True
 
     return False
 
-async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def check_user_message(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    *,
+    # Config flags bound as default arguments (local lookups on every message)
+    _moderate_admins: bool = MODERATE_ADMINS,
+    _moderate_bots: bool = MODERATE_BOTS,
+    _zalgo_min: int = ZALGO_MIN_DIACRITICS,
+    _zalgo_ratio: float = ZALGO_RATIO_THRESHOLD,
+):
     """Handle non-command messages from regular users to check for spam, links, and banned words."""
     if not update.message or not update.effective_chat or not update.effective_user:
         return
@@ -342,11 +380,11 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     add_user_message_id(update.effective_chat.id, update.effective_user.id, update.message.message_id)
 
     # If we are not moderating admins, check if the user is a chat admin via API.
-    if not MODERATE_ADMINS:
+    if not _moderate_admins:
         try:
-            # This is a more reliable check than the old `is_admin` as it queries the API
-            member = await context.bot.get_chat_member(update.effective_chat.id, update.effective_user.id)
-            if member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
+            # This is a more reliable check than the old `is_admin` as it queries the API (cached with a short TTL)
+            status = await get_member_status(context.bot, update.effective_chat.id, update.effective_user.id)
+            if status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
                 logger.debug(f"Ignoring message from chat admin {update.effective_user.id} in chat {update.effective_chat.id} based on MODERATE_ADMINS setting.")
                 return
         except Exception as e:
@@ -355,7 +393,7 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
             logger.warning(f"Could not check admin status for user {update.effective_user.id}: {e}")
 
     # --- Bot moderation check ---
-    if update.effective_user.is_bot and not MODERATE_BOTS:
+    if update.effective_user.is_bot and not _moderate_bots:
         logger.debug(f"Ignoring message from bot {update.effective_user.id} in chat {update.effective_chat.id} based on MODERATE_BOTS setting.")
         return
 
@@ -372,8 +410,10 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
 
-    # Get message text early to use in all relevant checks
+    # Get message text early to use in all relevant checks.
+    # Normalize once here; mimicry and banned-word checks share the result.
     message_text = update.message.text or update.message.caption or ""
+    normalized_message_text = normalize_text(message_text)
 
     # --- -1. Global ban check ---
     if db.is_banned(user_id):
@@ -404,7 +444,7 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # --- NEW: Bot Mimicking Check ---
     # This check should be early to prevent trolls from triggering other warnings with bot's own text.
-    handled = await _check_bot_mimicking(update, context, user_id, message_text)
+    handled = await _check_bot_mimicking(update, context, user_id, normalized_message_text)
     if handled:
         return
 
@@ -449,8 +489,8 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # --- 3. Zalgo text check ---
     if is_zalgo_text(
         message_text,
-        min_diacritics=ZALGO_MIN_DIACRITICS,
-        ratio_threshold=ZALGO_RATIO_THRESHOLD
+        min_diacritics=_zalgo_min,
+        ratio_threshold=_zalgo_ratio
     ):
         try:
             await update.message.delete()
@@ -470,7 +510,7 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     # Также проверяем текст на наличие ссылок, которые Telegram мог не распознать как сущности.
     has_link_in_text = False
     if not has_link_entity and message_text:
-        normalized_text = message_text.lower()
+        lowered_text = message_text.lower()
         # Упростим проверку для начала
         link_patterns = [
             r'https?://',
@@ -480,7 +520,7 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
         ]
         
         for pattern in link_patterns:
-            if re.search(pattern, normalized_text):
+            if re.search(pattern, lowered_text):
                 has_link_in_text = True
                 logger.debug(f"Found link pattern '{pattern}' in text")
                 break
@@ -547,24 +587,40 @@ async def check_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not message_text:
         return
 
-    banned_words = db.get_chat_ban_words(chat_id)
-    if not banned_words:
+    banned_words_pattern = _get_banned_words_pattern(chat_id)
+    if not banned_words_pattern:
         return
-    
-    normalized_message_text = normalize_text(message_text)
-    for word in banned_words:
-        # Banned words in DB are already normalized
-        if word in normalized_message_text:
-            # Delete the message with the banned word BEFORE the ban
-            try:
-                await update.message.delete()
-                logger.info(f"Deleted message with banned word '{word}' from user {user.id}")
-            except Exception as e:
-                logger.warning(f"Failed to delete message with banned word from user {user.id}: {e}")
 
-            await _ban_for_word(update, context, user, chat_id, word, is_edited=bool(update.edited_message))
-            # Stop processing after the first violation is handled
-            raise ApplicationHandlerStop
+    # Banned words in DB are already normalized
+    match = banned_words_pattern.search(normalized_message_text)
+    if match:
+        word = match.group(0)
+        # Delete the message with the banned word BEFORE the ban
+        try:
+            await update.message.delete()
+            logger.info(f"Deleted message with banned word '{word}' from user {user.id}")
+        except Exception as e:
+            logger.warning(f"Failed to delete message with banned word from user {user.id}: {e}")
+
+        await _ban_for_word(update, context, user, chat_id, word, is_edited=bool(update.edited_message))
+        # Stop processing after the first violation is handled
+        raise ApplicationHandlerStop
+
+
+def _get_banned_words_pattern(chat_id: int) -> Optional[re.Pattern]:
+    """
+    Returns one alternation regex over the chat's banned words (None if there are none).
+    Recompiled only when db.get_ban_words_version changes.
+    """
+    version = db.get_ban_words_version(chat_id)
+    cached = BANNED_WORDS_CACHE.get(chat_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    banned_words = db.get_chat_ban_words(chat_id)
+    pattern = re.compile("|".join(map(re.escape, banned_words))) if banned_words else None
+    BANNED_WORDS_CACHE[chat_id] = (version, pattern)
+    return pattern
 
 
 async def _check_spam(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, message_text: str) -> bool:
@@ -653,7 +709,14 @@ async def handle_triggers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             logger.error(f"Error sending trigger response in chat {chat_id}: {e}")
 
-async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_edited_message(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    *,
+    _moderate_admins: bool = MODERATE_ADMINS,
+    _zalgo_min: int = ZALGO_MIN_DIACRITICS,
+    _zalgo_ratio: float = ZALGO_RATIO_THRESHOLD,
+):
     """
     Checks edited messages for forbidden words and bans the user if found.
     """
@@ -674,10 +737,10 @@ async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TY
         pass
 
     # Don't check admins (if configured)
-    if not MODERATE_ADMINS:
+    if not _moderate_admins:
         try:
-            member = await context.bot.get_chat_member(update.edited_message.chat_id, update.edited_message.from_user.id)
-            if member.status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
+            status = await get_member_status(context.bot, update.edited_message.chat_id, update.edited_message.from_user.id)
+            if status in [ChatMember.ADMINISTRATOR, ChatMember.OWNER]:
                 return # Silently ignore edits from admins
         except Exception:
             pass # If check fails, proceed, ban will likely fail if they are admin
@@ -691,8 +754,8 @@ async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TY
     # --- Zalgo check for edited messages ---
     if is_zalgo_text(
         text,
-        min_diacritics=ZALGO_MIN_DIACRITICS,
-        ratio_threshold=ZALGO_RATIO_THRESHOLD
+        min_diacritics=_zalgo_min,
+        ratio_threshold=_zalgo_ratio
     ):
         try:
             await update.edited_message.delete()
@@ -705,18 +768,16 @@ async def handle_edited_message(update: Update, context: ContextTypes.DEFAULT_TY
         raise ApplicationHandlerStop
 
     # Check against banned words for this chat
-    banned_words = db.get_chat_ban_words(chat_id)
-    if not banned_words:
+    banned_words_pattern = _get_banned_words_pattern(chat_id)
+    if not banned_words_pattern:
         return
 
-    normalized_text = normalize_text(text)
-
-    for word in banned_words:
-        # Banned words in DB are already normalized
-        if word in normalized_text:
-            await _ban_for_word(update, context, user, chat_id, word, is_edited=True)
-            # Stop processing after the first violation is handled
-            raise ApplicationHandlerStop
+    # Banned words in DB are already normalized
+    match = banned_words_pattern.search(normalize_text(text))
+    if match:
+        await _ban_for_word(update, context, user, chat_id, match.group(0), is_edited=True)
+        # Stop processing after the first violation is handled
+        raise ApplicationHandlerStop
 
 async def handle_karma(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles karma increase from user replies."""
@@ -725,7 +786,9 @@ async def handle_karma(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Check if the message is a simple karma-giving word
-    if normalize_text(update.message.text) not in ('+', 'спасибо', 'дякую', 'thanks'):
+    # (length check first, so long replies never reach normalize_text)
+    text = update.message.text
+    if len(text) > KARMA_WORD_MAX_LEN or normalize_text(text) not in KARMA_WORDS:
         return
 
     giver = update.effective_user
@@ -739,51 +802,81 @@ async def handle_karma(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Prevent giving karma to the same message multiple times
     # We use a simple cache in context.chat_data
-    karma_cache = context.chat_data.setdefault('karma_given', {})
+    # (bounded, so long-running chats don't grow chat_data forever)
     message_id = update.message.reply_to_message.message_id
-    if karma_cache.get(message_id, set()) and giver.id in karma_cache.get(message_id, set()):
-        # User already gave karma for this message, silently ignore
-        return
+    karma_cache = context.chat_data.get('karma_given')
+    if karma_cache is not None:
+        givers = karma_cache.get(message_id)
+        if givers is not None and giver.id in givers:
+            # User already gave karma for this message, silently ignore
+            return
+    else:
+        karma_cache = context.chat_data['karma_given'] = LRUDict(KARMA_CACHE_SIZE)
 
     # Add karma point
     new_karma = db.change_karma(chat_id, receiver.id, 1)
 
     # Update cache
-    if message_id not in karma_cache:
-        karma_cache[message_id] = set()
-    karma_cache[message_id].add(giver.id)
+    karma_cache.setdefault(message_id, set()).add(giver.id)
 
-    # Notify (optional, can be removed if too noisy)
+    # Notify (optional, can be removed if too noisy).
+    # Sent in a background task so the handler doesn't wait for the Bot API round trip.
     receiver_mention = receiver.mention_html()
-    karma_msg = await update.message.reply_text(f"👍 {receiver_mention} получил(а) +1 к репутации. Теперь у него/неё {new_karma} очков.", parse_mode=ParseMode.HTML)
-    schedule_message_deletion(context.job_queue, chat_id, karma_msg.message_id, 10)
+
+    async def _send_karma_notification():
+        try:
+            karma_msg = await asyncio.wait_for(
+                update.message.reply_text(f"👍 {receiver_mention} получил(а) +1 к репутации. Теперь у него/неё {new_karma} очков.", parse_mode=ParseMode.HTML),
+                timeout=KARMA_NOTIFY_TIMEOUT
+            )
+            schedule_message_deletion(context.job_queue, chat_id, karma_msg.message_id, 10)
+        except Exception as e:
+            logger.warning(f"Failed to send karma notification in chat {chat_id}: {e}")
+
+    context.application.create_task(_send_karma_notification(), update=update)
+
+async def dispatch_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Single entry point for new group messages: moderation, then triggers, then karma.
+    An ApplicationHandlerStop raised by a step skips the remaining steps, just as it
+    used to skip the later handler groups. Any other exception is logged and the next
+    step still runs, as PTB did for separate handler groups.
+    """
+    steps = (check_user_message, handle_triggers, handle_karma)
+    # Moderation is only for regular users (see NonAdminFilter);
+    # triggers and karma work for all users, including admins.
+    if not non_admin_filter.check_update(update):
+        steps = steps[1:]
+    for step in steps:
+        try:
+            await step(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception as e:
+            logger.error(f"Error in {step.__name__} for chat {update.effective_chat.id}: {e}", exc_info=True)
+
+async def _flush_karma_job(context: ContextTypes.DEFAULT_TYPE):
+    """Writes buffered karma changes to the database."""
+    db.flush_karma()
 
 def register_message_handlers(application):
-    # Создаем фильтр для обычных пользователей (не админов)
-    # Этот фильтр будет использоваться для основного обработчика модерации.
-    class NonAdminFilter(filters.BaseFilter):
-        async def filter(self, message: Message) -> bool:
-            if not message.from_user or not message.chat:
-                return False
-            # Пропускаем, если модерация админов выключена и пользователь - админ
-            if not MODERATE_ADMINS:
-                member = await message.chat.get_member(message.from_user.id)
-                return member.status not in [ChatMember.ADMINISTRATOR, ChatMember.CREATOR]
-            return True
+    # Karma changes are buffered by db.change_karma and written in batches
+    application.job_queue.run_repeating(_flush_karma_job, interval=KARMA_FLUSH_INTERVAL, name="karma-flush")
 
+    # One handler for all new group messages instead of a separate group per check,
+    # so PTB evaluates a single filter chain per update.
     application.add_handler(
         MessageHandler(
-            NonAdminFilter() & ~filters.COMMAND & filters.ChatType.GROUPS,
-            check_user_message,
+            filters.UpdateType.MESSAGE & ~filters.COMMAND & filters.ChatType.GROUPS,
+            dispatch_group_message,
         ),
         group=0,
     )
 
-    # The trigger handler runs after moderation checks.
-    # It should work for all users, including admins.
+    # Triggers also answer in private chats.
     application.add_handler(
         MessageHandler(
-            filters.TEXT & ~filters.COMMAND,
+            filters.TEXT & ~filters.COMMAND & filters.ChatType.PRIVATE,
             handle_triggers,
         ),
         group=1,
@@ -794,12 +887,3 @@ def register_message_handlers(application):
         filters.UpdateType.EDITED_MESSAGE & filters.ChatType.GROUPS,
         handle_edited_message
     ), group=2)
-
-    # Karma handler - runs after moderation but before triggers
-    application.add_handler(
-        MessageHandler(
-            filters.REPLY & filters.TEXT & ~filters.COMMAND & filters.ChatType.GROUPS,
-            handle_karma
-        ),
-        group=3
-    )
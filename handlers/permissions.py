@@ -1,30 +1,58 @@
+import functools
+
 from telegram import ChatPermissions
 
+
+class _PrecomputedChatPermissions(ChatPermissions):
+    """
+    ChatPermissions whose API payload is built once at creation.
+    The constants below are sent with every restrict call, so `to_dict()`
+    returns a copy of the cached payload instead of re-reading every attribute.
+    """
+    __slots__ = ("_cached_dict",)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # TelegramObjects are frozen after __init__
+        with self._unfrozen():
+            self._cached_dict = super().to_dict()
+
+    def to_dict(self, recursive: bool = True):
+        return self._cached_dict.copy()
+
+
 # --- Permission Constants ---
+# Each permission set is an int bitmask over _PERMISSION_FLAGS (bit N = flag N),
+# so sets can be combined with bitwise ops; perms() builds the ChatPermissions
+# on first use and caches it.
 
-# Allows everything a normal user can do. Used for unmuting or after verification.
-PERMS_UNRESTRICTED = ChatPermissions(
-    can_send_messages=True, can_send_audios=True, can_send_documents=True,
-    can_send_photos=True, can_send_videos=True, can_send_video_notes=True,
-    can_send_voice_notes=True, can_send_polls=True, can_send_other_messages=True,
-    can_add_web_page_previews=True, can_invite_users=True
+_PERMISSION_FLAGS = (
+    'can_send_messages',          # 0x001
+    'can_send_audios',            # 0x002
+    'can_send_documents',         # 0x004
+    'can_send_photos',            # 0x008
+    'can_send_videos',            # 0x010
+    'can_send_video_notes',       # 0x020
+    'can_send_voice_notes',       # 0x040
+    'can_send_polls',             # 0x080
+    'can_send_other_messages',    # 0x100, this blocks stickers/gifs
+    'can_add_web_page_previews',  # 0x200, this blocks links
+    'can_invite_users',           # 0x400
 )
 
+# Allows everything a normal user can do. Used for unmuting or after verification.
+PERMS_UNRESTRICTED_MASK = 0b11111111111
+
 # Restricts a user to sending only text messages. Used for new members without captcha.
-PERMS_MEDIA_RESTRICT = ChatPermissions(
-    can_send_messages=True,
-    can_send_audios=False, can_send_documents=False, can_send_photos=False,
-    can_send_videos=False, can_send_video_notes=False, can_send_voice_notes=False,
-    can_send_polls=False, can_send_other_messages=False,  # this blocks stickers/gifs
-    can_add_web_page_previews=False,  # this blocks links
-    can_invite_users=True
-)
+PERMS_MEDIA_RESTRICT_MASK = 0x001 | 0x400
 
 # Restricts a user from sending anything. Used for new members pending captcha.
-PERMS_FULL_RESTRICT = ChatPermissions(
-    can_send_messages=False, can_send_audios=False, can_send_documents=False,
-    can_send_photos=False, can_send_videos=False, can_send_video_notes=False,
-    can_send_voice_notes=False, can_send_polls=False, can_send_other_messages=False,
-    can_add_web_page_previews=False
-)
+PERMS_FULL_RESTRICT_MASK = 0
+
 
+@functools.lru_cache(maxsize=8)
+def perms(mask: int) -> ChatPermissions:
+    """Returns the (cached) ChatPermissions for a PERMS_*_MASK bitmask."""
+    return _PrecomputedChatPermissions(**{
+        flag: bool(mask & (1 << bit)) for bit, flag in enumerate(_PERMISSION_FLAGS)
+    })
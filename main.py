@@ -1,6 +1,15 @@
+import asyncio
 import logging
+import sys
 from telegram.ext import Application, CommandHandler
 
+# uvloop (libuv-based event loop) is optional; fall back to the default asyncio loop
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = sys.platform != 'win32'
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
 # Импортируем настройки из config
 from config import BOT_TOKEN, LOG_LEVEL, ADMIN_IDS
 
@@ -11,6 +20,8 @@ from handlers.message_handlers import register_message_handlers
 
 # Импорт экземпляра БД для корректной инициализации при старте
 from utils.database import db
+from utils.helpers import register_deletion_sweeper
+from utils.json_request import ORJSON_AVAILABLE, OrjsonHTTPXRequest
 from telegram import Update
 
 # Настройка логирования
@@ -23,6 +34,9 @@ logger = logging.getLogger(__name__)
 
 async def post_shutdown(application: Application) -> None:
     """Выполняется при остановке бота."""
+    # Записываем накопленные изменения до закрытия соединения
+    db.flush_karma()
+    db.flush_writes()
     db.close()
     logger.info("Бот остановлен, соединение с БД закрыто.")
 
@@ -34,14 +48,26 @@ def main() -> None:
         if not BOT_TOKEN or BOT_TOKEN == 'your_bot_token_here':
             logger.error("ОШИБКА: Токен бота не настроен. Пожалуйста, укажите BOT_TOKEN в файле .env")
             return
+
+        # Переключаемся на uvloop до создания цикла событий в run_polling
+        if UVLOOP_AVAILABLE:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logger.info("Используется цикл событий uvloop.")
             
         # Создание экземпляра Application
-        application = (
+        builder = (
             Application.builder()
             .token(BOT_TOKEN)
             .post_shutdown(post_shutdown)
-            .build()
         )
+        if ORJSON_AVAILABLE:
+            # Разбор ответов Bot API через orjson (размер пула как у PTB по умолчанию)
+            builder = (
+                builder
+                .request(OrjsonHTTPXRequest(connection_pool_size=256))
+                .get_updates_request(OrjsonHTTPXRequest())
+            )
+        application = builder.build()
 
         # Регистрация всех обработчиков
         register_admin_handlers(application)
@@ -53,14 +79,21 @@ def main() -> None:
         application.add_handler(CommandHandler("list_ban_words", list_ban_words))
         logger.info("Все обработчики зарегистрированы.")
 
+        # Одна периодическая задача удаляет все отложенные сообщения
+        register_deletion_sweeper(application.job_queue)
+
         # Запуск бота в режиме опроса
         logger.info("Бот запущен и работает...")
         logger.info(f"ID администраторов: {ADMIN_IDS if ADMIN_IDS else 'не указаны'}")
         
         # Запускаем бота с обработкой всех типов обновлений
+        # Long polling: один запрос getUpdates держится до 30 секунд.
+        # PTB сам добавляет timeout к read_timeout запроса getUpdates.
         application.run_polling(
             allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True  # Пропускать накопившиеся обновления
+            drop_pending_updates=True,  # Пропускать накопившиеся обновления
+            poll_interval=0.0,
+            timeout=30
         )
     except KeyboardInterrupt:
         logger.info("Получен сигнал (Ctrl+C), инициирую остановку бота...")
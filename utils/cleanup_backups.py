@@ -1,3 +1,4 @@
+import os
 import time
 import logging
 from pathlib import Path
@@ -18,14 +19,23 @@ def cleanup_old_backups():
     
     logger.info(f"Running cleanup of backups older than {BACKUP_RETENTION_DAYS} days in {BACKUP_DIR}...")
     
+    cutoff = now - retention_period_seconds
     deleted_count = 0
-    for filepath in BACKUP_DIR.iterdir():
-        if filepath.is_file() and filepath.stat().st_mtime < (now - retention_period_seconds):
-            try:
-                filepath.unlink()
-                logger.info(f"Deleted old backup: {filepath.name}")
-                deleted_count += 1
-            except Exception as e:
-                logger.error(f"Error deleting backup file {filepath}: {e}")
+    deleted_bytes = 0
+    # os.scandir caches file type and stat results from the directory read,
+    # so each entry costs at most one stat() instead of two.
+    with os.scandir(BACKUP_DIR) as entries:
+        for entry in entries:
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                    logger.debug("Deleted old backup: %s", entry.name)
+                    deleted_count += 1
+                    deleted_bytes += stat.st_size
+                except Exception as e:
+                    logger.error(f"Error deleting backup file {entry.path}: {e}")
 
-    logger.info(f"Cleanup complete. Deleted {deleted_count} old backup(s).")
\ No newline at end of file
+    logger.info("Cleanup complete. Deleted %d old backup(s), freed %.1f MiB.", deleted_count, deleted_bytes / 1048576)
\ No newline at end of file
@@ -1,33 +1,97 @@
+import functools
 import json
 import logging
+import re
 import time
 import sqlite3
+from itertools import groupby
+from operator import itemgetter
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import timedelta
-from typing import List, Dict, Set, Optional, Any, Tuple
+from typing import List, Dict, Set, Optional, Any, Tuple, Iterable
+
+# orjson is optional; migrate_old_data falls back to the stdlib parser
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
 
 # Robust import of config when running this file directly
 try:
-    from config import TRIGGERS_FILE, BANNED_USERS_FILE
+    from config import TRIGGERS_FILE, BANNED_USERS_FILE, DB_EXCLUSIVE_LOCK
 except ModuleNotFoundError:
     # Add project root to sys.path
     import sys, os
     sys.path.append(os.path.dirname(os.path.dirname(__file__)))
-    from config import TRIGGERS_FILE, BANNED_USERS_FILE
+    from config import TRIGGERS_FILE, BANNED_USERS_FILE, DB_EXCLUSIVE_LOCK
 
 # Import db_schema in a way that works both as package and script
 try:
-    from .database_schema import db_schema  # when imported as package
+    from .database_schema import db_schema, SCHEMA_VERSION  # when imported as package
 except Exception:
     # Fallback for direct script execution
-    from utils.database_schema import db_schema
+    from utils.database_schema import db_schema, SCHEMA_VERSION
 
 logger = logging.getLogger(__name__)
 
+# Buffered karma changes are written once this many users are pending
+KARMA_FLUSH_SIZE = 128
+# Buffered member upserts are written once this many members are pending
+MEMBER_FLUSH_SIZE = 256
+# Queued fire-and-forget writes are done once this many statements are pending
+WRITE_QUEUE_FLUSH_SIZE = 256
+
+_MARK_LEFT_SQL = """
+    INSERT INTO known_members (chat_id, user_id, is_member, last_seen, updated_at)
+    VALUES (?, ?, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(chat_id, user_id) DO UPDATE SET
+        is_member=0,
+        updated_at=CURRENT_TIMESTAMP
+"""
+# Hot-path statements; sqlite3's statement cache (cached_statements=256 in db_schema)
+# is keyed by SQL text, so each of these is prepared once per connection
+_CHAT_TRIGGERS_SQL = """
+    SELECT trigger, response FROM triggers 
+    WHERE chat_id = ?
+    ORDER BY LENGTH(trigger) DESC
+"""
+_LOG_MODERATION_SQL = """
+    INSERT INTO moderation_logs (chat_id, user_id, action, admin_id, reason, duration_seconds)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+_MARK_PROFILE_CHECKED_SQL = """
+    INSERT INTO profile_checks (chat_id, user_id, last_check_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(chat_id, user_id) DO UPDATE SET
+        last_check_at=CURRENT_TIMESTAMP
+"""
+
+# banned_avatars.phash_int holds the 64-bit phash as SQLite's signed INTEGER
+_UINT64_MASK = (1 << 64) - 1
+
+def _phash_to_sql(phash: Optional[str]) -> Optional[int]:
+    """Encode a phash hex string as a signed 64-bit int (None if missing or malformed)."""
+    try:
+        value = int(phash, 16)
+    except (TypeError, ValueError):
+        return None
+    if value > _UINT64_MASK:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _pick(obj: Any, *fields: str) -> Tuple[Any, ...]:
+    """Read fields from a dict or from an object's attributes (missing ones are None)."""
+    if isinstance(obj, dict):
+        return tuple(obj.get(field) for field in fields)
+    return tuple(getattr(obj, field, None) for field in fields)
+
 class Database:
     def __init__(self):
         # Initialize the database schema first
         self.conn = db_schema.conn
+        # Rows support both index and name access; dict(row) is built in C
+        self.conn.row_factory = sqlite3.Row
         self.cursor = self.conn.cursor()
         
         # Initialize in-memory data structures
@@ -36,11 +100,69 @@ class Database:
         self.ban_patterns: List[str] = []
         self.ban_words: Set[str] = set()
         self.ban_nickname_words: Dict[int, Set[str]] = {}  # chat_id -> set of words
+        # chat_id -> (alternation over lowercased nickname words, lowercased -> stored word);
+        # built on first check, evicted whenever the chat's nickname words change
+        self._nick_re: Dict[int, Tuple[Optional[re.Pattern], Dict[str, str]]] = {}
+        self._whitelist: Dict[int, Set[int]] = {}  # chat_id -> whitelisted user ids
+        self._chat_admins: Dict[int, Set[int]] = {}  # chat_id -> chat admin user ids
+        self._banned_avatar_ids: Set[str] = set()  # file_unique_id of every banned avatar
+        # Banned phashes decoded to ints for Hamming comparison; None until first read
+        self._phash_cache: Optional[Tuple[int, ...]] = None
+        # chat_id -> (version, words); a version bump on add/remove invalidates the entry
+        self._ban_words_cache: Dict[int, Tuple[int, Tuple[str, ...]]] = {}
+        self._ban_words_version: Dict[int, int] = {}
+        # chat_id -> (matcher over lowercased triggers, trigger -> response); evicted by add/remove_trigger
+        self._triggers_cache: Dict[int, Tuple[Optional[re.Pattern], Dict[str, str]]] = {}
+        # (chat_id, user_id) -> karma delta not yet written; flushed in batches by flush_karma
+        self._karma_buffer: Dict[Tuple[int, int], int] = {}
+        # chat_id -> chat_settings flags; loaded on first read, evicted by every chat_settings write
+        self._chat_flags: Dict[int, Dict[str, bool]] = {}
+        # (chat_id, user_id) -> known_members row not yet written; flushed by flush_writes
+        self._member_buffer: Dict[Tuple[int, int], Tuple[Any, ...]] = {}
+        # SQL template -> params of fire-and-forget writes not yet done; flushed by flush_writes
+        self._write_queue: Dict[str, List[Tuple[Any, ...]]] = {}
+        self._write_queue_size = 0
+        # Nesting level of transaction() blocks; only the outermost one commits
+        self._transaction_depth = 0
         
         # Create tables and load data
+        self._tune_connection()
         self._create_tables()
         self._load_data()
 
+    def _tune_connection(self):
+        """
+        Connection PRAGMAs (WAL, synchronous, caches) are set by db_schema before
+        the schema DDL; only the bot-specific lock mode is chosen here.
+        """
+        if not DB_EXCLUSIVE_LOCK or str(db_schema.db_path) == ':memory:':
+            return
+        try:
+            # Opt-in: the bot keeps the file lock instead of re-taking it on every
+            # transaction. db_schema has already opened the WAL and its -shm index,
+            # so the shared-memory index is still used; this only saves lock calls.
+            self.conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        except sqlite3.Error as e:
+            logger.error(f"Error tuning database connection: {e}")
+
+    def checkpoint(self) -> bool:
+        """Fold the WAL back into the main DB file (call before copying the file)."""
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error checkpointing database: {e}")
+            return False
+
+    def incremental_vacuum(self, pages: int = 1000) -> bool:
+        """Return up to `pages` free pages to the OS (no-op unless auto_vacuum is INCREMENTAL)."""
+        try:
+            self.conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"Error running incremental vacuum: {e}")
+            return False
+
     def _create_tables(self):
         # Ensure the connection is good
         self.conn.execute("PRAGMA foreign_keys = ON")
@@ -62,31 +184,23 @@ class Database:
         self.cursor.execute('''
         CREATE TABLE IF NOT EXISTS chat_rules (
             chat_id INTEGER PRIMARY KEY,
-            rules_text TEXT NOT NULL,
+            rules_text TEXT,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            rules_ad_text TEXT,
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id) ON DELETE CASCADE
         )
         ''')
-        # Add ad text column if it doesn't exist
-        self.cursor.execute("PRAGMA table_info(chat_rules)")
-        chat_rules_columns = [col[1] for col in self.cursor.fetchall()]
-        if 'rules_ad_text' not in chat_rules_columns:
-            self.cursor.execute('ALTER TABLE chat_rules ADD COLUMN rules_ad_text TEXT')
 
         # Create welcome settings table
         self.cursor.execute('''
         CREATE TABLE IF NOT EXISTS welcome_settings (
             chat_id INTEGER PRIMARY KEY,
-            message_text TEXT NOT NULL,
+            message_text TEXT,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            welcome_ad_text TEXT,
             FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id) ON DELETE CASCADE
         )
         ''')
-        # Add ad text column if it doesn't exist
-        self.cursor.execute("PRAGMA table_info(welcome_settings)")
-        welcome_settings_columns = [col[1] for col in self.cursor.fetchall()]
-        if 'welcome_ad_text' not in welcome_settings_columns:
-            self.cursor.execute('ALTER TABLE welcome_settings ADD COLUMN welcome_ad_text TEXT')
 
         # Create profile checks table
         self.cursor.execute('''
@@ -98,7 +212,138 @@ class Database:
         )
         ''')
 
+        # Index for the unchecked-members scan (profile_checks is covered by its primary key)
+        self.cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_km_chat_active ON known_members(chat_id, is_member, user_id)
+        ''')
+
+        # Create karma table
+        self.cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_karma (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        ''')
+
         self.conn.commit()
+        self._migrate_schema()
+
+    def _migrate_schema(self):
+        """
+        Apply one-shot column migrations tracked by PRAGMA user_version,
+        so a steady-state startup costs a single PRAGMA read.
+        """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        with self.transaction():
+            if version < 1:
+                # Databases created before versioning may already have the ad columns
+                for table, column in (('chat_rules', 'rules_ad_text'), ('welcome_settings', 'welcome_ad_text')):
+                    columns = {col[1] for col in self.cursor.execute(f"PRAGMA table_info({table})")}
+                    if column not in columns:
+                        self.cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+            if version < 2:
+                # Ad-only rows no longer store placeholder text: drop NOT NULL by rebuilding
+                for table, column, ad_column in (
+                    ('chat_rules', 'rules_text', 'rules_ad_text'),
+                    ('welcome_settings', 'message_text', 'welcome_ad_text'),
+                ):
+                    notnull = {col[1]: col[3] for col in self.cursor.execute(f"PRAGMA table_info({table})")}
+                    if not notnull.get(column):
+                        continue
+                    self.cursor.execute(f'''
+                    CREATE TABLE {table}_new (
+                        chat_id INTEGER PRIMARY KEY,
+                        {column} TEXT,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        {ad_column} TEXT,
+                        FOREIGN KEY (chat_id) REFERENCES chat_settings(chat_id) ON DELETE CASCADE
+                    )
+                    ''')
+                    self.cursor.execute(
+                        f"INSERT INTO {table}_new (chat_id, {column}, updated_at, {ad_column}) "
+                        f"SELECT chat_id, {column}, updated_at, {ad_column} FROM {table}"
+                    )
+                    self.cursor.execute(f"DROP TABLE {table}")
+                    self.cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+            if version < 3:
+                # moderation_logs.created_at: TEXT timestamps -> integer unix seconds,
+                # so the daily stats range scan compares integers against a bound parameter
+                types = {col[1]: col[2] for col in self.cursor.execute("PRAGMA table_info(moderation_logs)")}
+                if types.get('created_at', '').upper() != 'INTEGER':
+                    self.cursor.execute('''
+                    CREATE TABLE moderation_logs_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        chat_id INTEGER,
+                        user_id INTEGER NOT NULL,
+                        action TEXT NOT NULL,
+                        reason TEXT,
+                        duration_seconds INTEGER,
+                        admin_id INTEGER,
+                        created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+                    )
+                    ''')
+                    self.cursor.execute('''
+                    INSERT INTO moderation_logs_new
+                        (id, chat_id, user_id, action, reason, duration_seconds, admin_id, created_at)
+                    SELECT id, chat_id, user_id, action, reason, duration_seconds, admin_id,
+                           COALESCE(CAST(strftime('%s', created_at) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER))
+                    FROM moderation_logs
+                    ''')
+                    self.cursor.execute("DROP TABLE moderation_logs")
+                    self.cursor.execute("ALTER TABLE moderation_logs_new RENAME TO moderation_logs")
+                    self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_action_time ON moderation_logs(action, created_at)')
+                    self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_user_action ON moderation_logs(user_id, action)')
+            if version < 4:
+                # Integer phash column: 8 bytes per row and no hex parsing on reads
+                columns = {col[1] for col in self.cursor.execute("PRAGMA table_info(banned_avatars)")}
+                if 'phash_int' not in columns:
+                    self.cursor.execute('ALTER TABLE banned_avatars ADD COLUMN phash_int INTEGER')
+                rows = self.cursor.execute("SELECT id, phash FROM banned_avatars WHERE phash IS NOT NULL").fetchall()
+                self.cursor.executemany(
+                    "UPDATE banned_avatars SET phash_int = ? WHERE id = ?",
+                    [(_phash_to_sql(phash), row_id) for row_id, phash in rows]
+                )
+                self.cursor.execute('DROP INDEX IF EXISTS idx_banned_avatars_phash')
+                self.cursor.execute('CREATE INDEX IF NOT EXISTS idx_banned_avatars_phash_int ON banned_avatars(phash_int)')
+            if version < 5:
+                # Plain indexes that duplicated a UNIQUE / PRIMARY KEY index: dead weight on every write
+                for index in (
+                    'idx_triggers_chat_id', 'idx_ban_words_chat_word', 'idx_ban_nickname_words_chat_word',
+                    'idx_ban_bio_words_chat_word', 'idx_banned_users_user_id', 'idx_known_members_chat_user',
+                    'idx_bannable_domains_chat_domain', 'idx_chat_admins_chat_user',
+                    'idx_whitelisted_users_chat_user', 'idx_banned_avatars_unique_id',
+                ):
+                    self.cursor.execute(f'DROP INDEX IF EXISTS {index}')
+            if version < 6:
+                # Every user_warnings lookup binds both user_id and chat_id, which UNIQUE(user_id, chat_id) covers
+                self.cursor.execute('DROP INDEX IF EXISTS idx_uw_chat_user')
+            self.cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        if version < 7:
+            self._enable_incremental_vacuum(version)
+        logger.info(f"Database schema migrated from version {version} to {SCHEMA_VERSION}")
+
+    def _enable_incremental_vacuum(self, version: int):
+        """
+        Switch a database created before auto_vacuum=INCREMENTAL with a one-time VACUUM;
+        the pragma alone only takes effect on an empty file. VACUUM cannot run inside a
+        transaction, so this runs after the migration commit.
+        """
+        if str(db_schema.db_path) == ':memory:':
+            return
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return
+        try:
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+            logger.info("Database rebuilt with auto_vacuum=INCREMENTAL")
+        except sqlite3.Error as e:
+            # Put the version back so the next startup retries the conversion
+            self.conn.execute(f"PRAGMA user_version = {min(version, 6)}")
+            logger.error(f"Error switching database to incremental auto_vacuum: {e}")
 
     def close(self):
         """Closes the database connection via the schema object and nullifies local references."""
@@ -108,12 +353,6 @@ class Database:
             self.cursor = None
             logger.info("Database connection has been closed and references nullified.")
 
-    def __del__(self):
-        """Ensure the database connection is closed when the object is destroyed."""
-        # The connection is managed by db_schema, which has its own __del__.
-        # No need to do anything here to prevent double-closing.
-        pass
-
     def warn_user(self, user_id: int, chat_id: int, warned_by: int, reason: str = None) -> bool:
         """Add a warning for a user.
         
@@ -127,15 +366,15 @@ class Database:
             bool: True if warning was added, False if user already has a warning
         """
         try:
-            self.cursor.execute(
-                """
-                INSERT OR IGNORE INTO user_warnings (user_id, chat_id, warned_by, reason)
-                VALUES (?, ?, ?, ?)
-                """,
-                (user_id, chat_id, warned_by, reason)
-            )
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction():
+                self.cursor.execute(
+                    """
+                    INSERT OR IGNORE INTO user_warnings (user_id, chat_id, warned_by, reason)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (user_id, chat_id, warned_by, reason)
+                )
+                return self.cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error warning user {user_id}: {e}")
             return False
@@ -151,15 +390,15 @@ class Database:
             bool: True if warning was removed, False if no warning was found
         """
         try:
-            self.cursor.execute(
-                """
-                DELETE FROM user_warnings
-                WHERE user_id = ? AND chat_id = ?
-                """,
-                (user_id, chat_id)
-            )
-            self.conn.commit()
-            return self.cursor.rowcount > 0
+            with self.transaction():
+                self.cursor.execute(
+                    """
+                    DELETE FROM user_warnings
+                    WHERE user_id = ? AND chat_id = ?
+                    """,
+                    (user_id, chat_id)
+                )
+                return self.cursor.rowcount > 0
         except Exception as e:
             logger.error(f"Error unwarning user {user_id}: {e}")
             return False
@@ -183,10 +422,7 @@ class Database:
                 (user_id, chat_id)
             )
             row = self.cursor.fetchone()
-            if row:
-                columns = [col[0] for col in self.cursor.description]
-                return dict(zip(columns, row))
-            return None
+            return dict(row) if row else None
         except Exception as e:
             logger.error(f"Error getting warning for user {user_id}: {e}")
             return None
@@ -200,7 +436,7 @@ class Database:
             
             # Load ban patterns from database
             cursor = self._execute("SELECT pattern, description FROM ban_patterns", commit=False)
-            self.ban_patterns = [{'pattern': row[0], 'description': row[1]} for row in cursor.fetchall()]
+            self.ban_patterns = [dict(row) for row in cursor.fetchall()]
             
             # Load banned users from database
             cursor = self._execute(
@@ -211,8 +447,8 @@ class Database:
                 """,
                 commit=False
             )
-            for row in cursor.fetchall():
-                self.banned_users[row[0]] = {
+            self.banned_users = {
+                row[0]: {
                     'username': row[1],
                     'first_name': row[2],
                     'last_name': row[3],
@@ -220,16 +456,35 @@ class Database:
                     'admin_id': row[5],
                     'banned_at': row[6]
                 }
+                for row in cursor.fetchall()
+            }
             
             # Load banned nickname words from database
             cursor = self._execute(
                 "SELECT chat_id, word FROM ban_nickname_words ORDER BY chat_id, word",
                 commit=False
             )
-            for chat_id, word in cursor.fetchall():
-                if chat_id not in self.ban_nickname_words:
-                    self.ban_nickname_words[chat_id] = set()
-                self.ban_nickname_words[chat_id].add(word)
+            # Rows come ordered by chat_id, so each chat's set is built from one group
+            self.ban_nickname_words = {
+                chat_id: {row[1] for row in rows}
+                for chat_id, rows in groupby(cursor.fetchall(), key=itemgetter(0))
+            }
+
+            # Load whitelists and chat admins from database
+            cursor = self._execute("SELECT chat_id, user_id FROM whitelisted_users ORDER BY chat_id", commit=False)
+            self._whitelist = {
+                chat_id: {row[1] for row in rows}
+                for chat_id, rows in groupby(cursor.fetchall(), key=itemgetter(0))
+            }
+            cursor = self._execute("SELECT chat_id, user_id FROM chat_admins ORDER BY chat_id", commit=False)
+            self._chat_admins = {
+                chat_id: {row[1] for row in rows}
+                for chat_id, rows in groupby(cursor.fetchall(), key=itemgetter(0))
+            }
+
+            # Load banned avatar ids so is_avatar_banned never touches the database
+            cursor = self._execute("SELECT file_unique_id FROM banned_avatars", commit=False)
+            self._banned_avatar_ids = set(map(itemgetter(0), cursor))
                 
         except sqlite3.Error as e:
             logger.error(f"Error loading data from database: {e}")
@@ -238,154 +493,264 @@ class Database:
             self.ban_patterns = []
             self.banned_users = {}
             self.ban_nickname_words = {}
+            self._whitelist = {}
+            self._chat_admins = {}
+            self._banned_avatar_ids = set()
 
     def migrate_old_data(self):
-        """Migrate data from JSON files to SQLite database."""
+        """
+        Migrate data from JSON files to SQLite database.
+        Rows are collected first and written with executemany in a single transaction.
+        """
         try:
-            # Migrate triggers (if needed)
+            ban_words: List[str] = []
+            ban_nickname_words: List[str] = []
+            ban_patterns: List[str] = []
+            banned_users: List[Tuple[Any, ...]] = []
+
             if TRIGGERS_FILE.exists():
-                with open(TRIGGERS_FILE, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    if isinstance(data, dict):
-                        # Migrate ban words
-                        for word in data.get('ban_words', []):
-                            self.add_ban_word(0, word)
-                            
-                        # Migrate ban nickname words
-                        for word in data.get('ban_nickname_words', []):
-                            self.add_ban_nickname_word(0, word)
-                            
-                        # Migrate ban patterns
-                        for pattern in data.get('ban_patterns', []):
-                            self.add_ban_pattern(pattern)
-                            
-                        # Migrate word patterns
-                        for pattern in data.get('ban_word_patterns', []):
-                            self.add_ban_pattern(pattern)
-                    
-                    # After migration, rename the old file
-                    old_file = TRIGGERS_FILE.rename(f"{TRIGGERS_FILE}.old")
-                    logger.info(f"Migrated old data from {TRIGGERS_FILE} to SQLite")
-            
-            # Migrate banned users
+                data = _json_loads(TRIGGERS_FILE.read_bytes())
+                if isinstance(data, dict):
+                    ban_words = list(dict.fromkeys(data.get('ban_words', [])))
+                    ban_nickname_words = list(dict.fromkeys(data.get('ban_nickname_words', [])))
+                    ban_patterns = data.get('ban_patterns', []) + data.get('ban_word_patterns', [])
+
             if BANNED_USERS_FILE.exists():
-                with open(BANNED_USERS_FILE, 'r', encoding='utf-8') as f:
-                    banned_users = json.load(f)
-                    for user_id, data in banned_users.items():
-                        try:
-                            self.ban_user(
-                                user_id=int(user_id),
-                                reason=data.get('reason', 'No reason provided'),
-                                admin_id=data.get('admin_id', 0),
-                                username=data.get('username'),
-                                first_name=data.get('first_name'),
-                                last_name=data.get('last_name')
-                            )
-                        except (ValueError, KeyError) as e:
-                            logger.error(f"Error migrating banned user {user_id}: {e}")
-                
-                # After migration, rename the old file
-                old_file = BANNED_USERS_FILE.rename(f"{BANNED_USERS_FILE}.old")
-                logger.info(f"Migrated banned users from {BANNED_USERS_FILE} to SQLite")
-                
+                banned_users_data = _json_loads(BANNED_USERS_FILE.read_bytes())
+                for user_id, data in banned_users_data.items():
+                    try:
+                        banned_users.append((
+                            int(user_id), data.get('username'), data.get('first_name'),
+                            data.get('last_name'), data.get('reason', 'No reason provided'),
+                            data.get('admin_id', 0)
+                        ))
+                    except (ValueError, KeyError, AttributeError) as e:
+                        logger.error(f"Error migrating banned user {user_id}: {e}")
+
+            if not (ban_words or ban_nickname_words or ban_patterns or banned_users):
+                self._rename_migrated_files()
+                return
+
+            # Skip rows that already exist so only new ones are logged / cached
+            new_nickname_words = [w for w in ban_nickname_words if w not in self.ban_nickname_words.get(0, set())]
+            active_ids = {row[0] for row in self._execute(
+                "SELECT user_id FROM banned_users WHERE is_active = 1", commit=False
+            ).fetchall()}
+            banned_users = [row for row in banned_users if row[0] not in active_ids]
+            banned_users = list({row[0]: row for row in banned_users}.values())
+
+            with self.transaction():
+                if ban_words or ban_nickname_words:
+                    self.cursor.execute(
+                        "INSERT OR IGNORE INTO chat_settings (chat_id, title) VALUES (?, ?)",
+                        (0, "Chat 0")
+                    )
+                self.cursor.executemany(
+                    "INSERT OR IGNORE INTO ban_words (chat_id, word) VALUES (0, ?)",
+                    [(word,) for word in ban_words]
+                )
+                self.cursor.executemany(
+                    "INSERT OR IGNORE INTO ban_nickname_words (chat_id, word, added_by) VALUES (0, ?, NULL)",
+                    [(word,) for word in new_nickname_words]
+                )
+                self.cursor.executemany(
+                    """
+                    INSERT INTO ban_word_logs (chat_id, word_type, word, action, admin_id)
+                    VALUES (0, 'nickname', ?, 'add', NULL)
+                    """,
+                    [(word,) for word in new_nickname_words]
+                )
+                self.cursor.executemany(
+                    "INSERT OR IGNORE INTO ban_patterns (pattern, description) VALUES (?, NULL)",
+                    [(pattern,) for pattern in ban_patterns]
+                )
+                self.cursor.executemany(
+                    """
+                    INSERT INTO banned_users
+                    (user_id, username, first_name, last_name, reason, admin_id, is_active)
+                    VALUES (?, ?, ?, ?, ?, ?, 1)
+                    """,
+                    banned_users
+                )
+                self.cursor.executemany(
+                    """
+                    INSERT INTO moderation_logs (chat_id, user_id, action, admin_id, reason, duration_seconds)
+                    VALUES (NULL, ?, 'ban', ?, ?, NULL)
+                    """,
+                    [(row[0], row[5], row[4]) for row in banned_users]
+                )
+
+            if ban_words:
+                self._bump_ban_words_version(0)
+            for row in banned_users:
+                self.banned_users[row[0]] = {
+                    'username': row[1], 'first_name': row[2], 'last_name': row[3],
+                    'reason': row[4], 'admin_id': row[5], 'banned_at': None
+                }
+            if new_nickname_words:
+                self.ban_nickname_words.setdefault(0, set()).update(new_nickname_words)
+                self._nick_re.pop(0, None)
+
+            self._rename_migrated_files()
+
         except Exception as e:
             logger.error(f"Error during data migration: {e}")
             # Don't raise, continue with empty database if migration fails
 
-    def _execute(self, query: str, params: Tuple[Any, ...] = (), commit: bool = True) -> sqlite3.Cursor:
+    def _rename_migrated_files(self):
+        """Rename migrated JSON files so they are not imported again."""
+        if TRIGGERS_FILE.exists():
+            TRIGGERS_FILE.rename(f"{TRIGGERS_FILE}.old")
+            logger.info(f"Migrated old data from {TRIGGERS_FILE} to SQLite")
+        if BANNED_USERS_FILE.exists():
+            BANNED_USERS_FILE.rename(f"{BANNED_USERS_FILE}.old")
+            logger.info(f"Migrated banned users from {BANNED_USERS_FILE} to SQLite")
+
+    def _execute(self, query: str, params: Tuple[Any, ...] = (), commit: bool = False) -> sqlite3.Cursor:
         self.cursor.execute(query, params)
-        if commit:
+        if commit and not self._transaction_depth:
             self.conn.commit()
         return self.cursor
 
+    def _fetchone(self, query: str, params: Tuple[Any, ...] = ()) -> Optional[sqlite3.Row]:
+        """Run a point read on the shared cursor and return its single row (or None)."""
+        return self.cursor.execute(query, params).fetchone()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the enclosed writes in one BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error).
+        Nested blocks join the outermost transaction, which commits once.
+        """
+        if self._transaction_depth:
+            self._transaction_depth += 1
+            try:
+                yield self.cursor
+            finally:
+                self._transaction_depth -= 1
+            return
+
+        if self.conn.in_transaction:
+            # Finish a transaction left open by a direct write
+            self.conn.commit()
+        self.conn.execute("BEGIN IMMEDIATE")
+        self._transaction_depth = 1
+        try:
+            yield self.cursor
+        except BaseException:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+        finally:
+            self._transaction_depth = 0
+
     # Known members management
     def upsert_member(self, chat_id: int, user: Any, is_member: bool = True) -> bool:
         """Insert or update a known member record.
         Expects user to have attributes or dict keys: id, username, first_name, last_name.
+        The write is buffered (latest state per member wins) and done by flush_writes.
         """
-        try:
-            user_id = getattr(user, 'id', None) if not isinstance(user, dict) else user.get('id')
-            if not user_id:
-                return False
-            username = getattr(user, 'username', None) if not isinstance(user, dict) else user.get('username')
-            first_name = getattr(user, 'first_name', None) if not isinstance(user, dict) else user.get('first_name')
-            last_name = getattr(user, 'last_name', None) if not isinstance(user, dict) else user.get('last_name')
-
-            self._execute(
-                """
-                INSERT INTO known_members (chat_id, user_id, username, first_name, last_name, is_member, last_seen, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id, user_id) DO UPDATE SET
-                    username=excluded.username,
-                    first_name=excluded.first_name,
-                    last_name=excluded.last_name,
-                    is_member=excluded.is_member,
-                    last_seen=CURRENT_TIMESTAMP,
-                    updated_at=CURRENT_TIMESTAMP
-                """,
-                (chat_id, user_id, username, first_name, last_name, 1 if is_member else 0)
-            )
-            return True
-        except sqlite3.Error as e:
-            logger.error(f"Error upserting known member {chat_id}:{user_id}: {e}")
+        user_id, username, first_name, last_name = _pick(user, 'id', 'username', 'first_name', 'last_name')
+        if not user_id:
             return False
+        self._member_buffer[(chat_id, user_id)] = (
+            chat_id, user_id, username, first_name, last_name, 1 if is_member else 0
+        )
+        if len(self._member_buffer) >= MEMBER_FLUSH_SIZE:
+            # Through flush_writes, so a queued mark_left is written before this upsert
+            self.flush_writes()
+        return True
+
+    def _write_members(self, snapshot: Dict[Tuple[int, int], Tuple[Any, ...]]) -> None:
+        """Upsert a snapshot of the member buffer; errors propagate to the caller's transaction."""
+        self.cursor.executemany(
+            """
+            INSERT INTO known_members (chat_id, user_id, username, first_name, last_name, is_member, last_seen, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+            ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                username=excluded.username,
+                first_name=excluded.first_name,
+                last_name=excluded.last_name,
+                is_member=excluded.is_member,
+                last_seen=CURRENT_TIMESTAMP,
+                updated_at=CURRENT_TIMESTAMP
+            """,
+            list(snapshot.values())
+        )
+
+    def _forget_members(self, snapshot: Dict[Tuple[int, int], Tuple[Any, ...]]) -> None:
+        """Drop committed rows from the buffer, keeping entries replaced since the snapshot."""
+        for key, row in snapshot.items():
+            if self._member_buffer.get(key) is row:
+                del self._member_buffer[key]
 
     def mark_left(self, chat_id: int, user_id: int) -> bool:
-        """Mark a member as left the chat."""
-        try:
-            self._execute(
-                """
-                INSERT INTO known_members (chat_id, user_id, is_member, last_seen, updated_at)
-                VALUES (?, ?, 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id, user_id) DO UPDATE SET
-                    is_member=0,
-                    updated_at=CURRENT_TIMESTAMP
-                """,
-                (chat_id, user_id)
-            )
-            return True
-        except sqlite3.Error as e:
-            logger.error(f"Error marking member left {chat_id}:{user_id}: {e}")
-            return False
+        """Mark a member as left the chat. The write is queued and done by flush_writes."""
+        pending = self._member_buffer.get((chat_id, user_id))
+        if pending is not None:
+            # Keep the buffered names; only the membership flag changes
+            self._member_buffer[(chat_id, user_id)] = pending[:-1] + (0,)
+        else:
+            self._enqueue(_MARK_LEFT_SQL, (chat_id, user_id))
+        return True
+
+    def _enqueue(self, sql: str, params: Tuple[Any, ...]) -> None:
+        """Queue a write whose result nobody waits for; same templates are batched with executemany."""
+        self._write_queue.setdefault(sql, []).append(params)
+        self._write_queue_size += 1
+        if self._write_queue_size >= WRITE_QUEUE_FLUSH_SIZE:
+            self.flush_writes()
+
+    def flush_writes(self) -> int:
+        """
+        Do all queued writes and buffered member upserts in one transaction.
+        Queued statements go first, so a member who left and re-joined since
+        the last flush ends up as a member. Nothing leaves the queue or the member
+        buffer unless the whole transaction commits. Returns the number of rows written.
+        """
+        if not self.conn or not (self._write_queue or self._member_buffer):
+            return 0
+        queued = {sql: len(rows) for sql, rows in self._write_queue.items()}
+        members = dict(self._member_buffer)
+        try:
+            with self.transaction():
+                for sql, count in queued.items():
+                    self.cursor.executemany(sql, self._write_queue[sql][:count])
+                if members:
+                    self._write_members(members)
+        except sqlite3.Error as e:
+            logger.error(
+                f"Error flushing {sum(queued.values())} queued write(s) and {len(members)} member(s), "
+                f"kept for retry: {e}"
+            )
+            return 0
+        # Drop only the committed rows; anything queued since the snapshot stays
+        for sql, count in queued.items():
+            pending = self._write_queue[sql]
+            del pending[:count]
+            if not pending:
+                del self._write_queue[sql]
+        self._write_queue_size -= sum(queued.values())
+        self._forget_members(members)
+        return sum(queued.values()) + len(members)
 
     def get_known_members(self, chat_id: int, only_active: bool = True) -> List[Dict[str, Any]]:
         """Return known members for the chat."""
+        self.flush_writes()
         try:
-            if only_active:
-                cursor = self._execute(
-                    """
-                    SELECT user_id, username, first_name, last_name, is_member, last_seen
-                    FROM known_members
-                    WHERE chat_id = ? AND is_member = 1
-                    ORDER BY last_seen DESC
-                    """,
-                    (chat_id,),
-                    commit=False
-                )
-            else:
-                cursor = self._execute(
-                    """
-                    SELECT user_id, username, first_name, last_name, is_member, last_seen
-                    FROM known_members
-                    WHERE chat_id = ?
-                    ORDER BY last_seen DESC
-                    """,
-                    (chat_id,),
-                    commit=False
-                )
-            rows = cursor.fetchall()
-            return [
-                {
-                    'user_id': r[0],
-                    'username': r[1],
-                    'first_name': r[2],
-                    'last_name': r[3],
-                    'is_member': bool(r[4]),
-                    'last_seen': r[5],
-                }
-                for r in rows
-            ]
+            # One statement for both variants, so it stays in the prepared-statement cache
+            cursor = self._execute(
+                """
+                SELECT user_id, username, first_name, last_name, is_member, last_seen
+                FROM known_members
+                WHERE chat_id = ? AND (? = 0 OR is_member = 1)
+                ORDER BY last_seen DESC
+                """,
+                (chat_id, 1 if only_active else 0),
+                commit=False
+            )
+            return [dict(r) for r in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error fetching known members for chat {chat_id}: {e}")
             return []
@@ -394,36 +759,66 @@ class Database:
     def get_or_create_chat(self, chat_id: int, title: str = None) -> bool:
         """Get or create chat settings."""
         try:
-            self._execute(
-                """
-                INSERT OR IGNORE INTO chat_settings (chat_id, title) 
-                VALUES (?, ?)
-                """,
-                (chat_id, title or f"Chat {chat_id}")
-            )
-            if title:
+            with self.transaction():
+                # One statement: create with a placeholder title, or rename only when
+                # a real title was given and it actually changed
                 self._execute(
                     """
-                    UPDATE chat_settings 
-                    SET title = ?, updated_at = CURRENT_TIMESTAMP 
-                    WHERE chat_id = ?
+                    INSERT INTO chat_settings (chat_id, title)
+                    VALUES (?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        title = excluded.title,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE ? AND excluded.title IS NOT chat_settings.title
                     """,
-                    (title, chat_id)
+                    (chat_id, title or f"Chat {chat_id}", bool(title))
                 )
-            return True
+                # rowcount is 0 when the chat existed and nothing changed; only a
+                # newly created row can make the cached "missing row" flags stale
+                if self.cursor.rowcount > 0:
+                    self._chat_flags.pop(chat_id, None)
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error in get_or_create_chat: {e}")
             return False
 
+    def _set_chat_flag(self, chat_id: int, column: str, value: bool) -> None:
+        """Create the chat row if needed and set one boolean column, in a single UPSERT."""
+        # `column` is always one of the literal names passed by the setters below
+        self._execute(
+            f"""
+            INSERT INTO chat_settings (chat_id, title, {column})
+            VALUES (?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                {column} = excluded.{column},
+                updated_at = CURRENT_TIMESTAMP
+            """,
+            (chat_id, f"Chat {chat_id}", 1 if value else 0)
+        )
+        self._chat_flags.pop(chat_id, None)
+
+    def _get_chat_flags(self, chat_id: int) -> Dict[str, bool]:
+        """Get the boolean chat_settings columns of a chat (cached until the row is written)."""
+        flags = self._chat_flags.get(chat_id)
+        if flags is None:
+            cursor = self._execute(
+                "SELECT delete_links_enabled, welcome_captcha_enabled, is_active FROM chat_settings WHERE chat_id = ?",
+                (chat_id,)
+            )
+            row = cursor.fetchone() or (0, 0, 0)
+            flags = self._chat_flags[chat_id] = {
+                'delete_links_enabled': bool(row[0]),
+                'welcome_captcha_enabled': bool(row[1]),
+                'is_active': bool(row[2]),
+            }
+        return flags
+
     def set_link_deletion(self, chat_id: int, enabled: bool) -> bool:
         """Enable or disable automatic link deletion for a chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                "UPDATE chat_settings SET delete_links_enabled = ? WHERE chat_id = ?",
-                (1 if enabled else 0, chat_id)
-            )
-            return True
+            with self.transaction():
+                self._set_chat_flag(chat_id, 'delete_links_enabled', enabled)
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting link deletion for chat {chat_id}: {e}")
             return False
@@ -431,14 +826,7 @@ class Database:
     def is_link_deletion_enabled(self, chat_id: int) -> bool:
         """Check if automatic link deletion is enabled for a chat."""
         try:
-            cursor = self._execute(
-                "SELECT delete_links_enabled FROM chat_settings WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            result = cursor.fetchone()
-            # Ensure we return a boolean
-            return bool(result[0]) if result else False
+            return self._get_chat_flags(chat_id)['delete_links_enabled']
         except sqlite3.Error as e:
             logger.error(f"Error checking link deletion for chat {chat_id}: {e}")
             return False
@@ -446,12 +834,9 @@ class Database:
     def set_welcome_captcha(self, chat_id: int, enabled: bool) -> bool:
         """Enable or disable welcome captcha for a chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                "UPDATE chat_settings SET welcome_captcha_enabled = ? WHERE chat_id = ?",
-                (1 if enabled else 0, chat_id)
-            )
-            return True
+            with self.transaction():
+                self._set_chat_flag(chat_id, 'welcome_captcha_enabled', enabled)
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting welcome captcha for chat {chat_id}: {e}")
             return False
@@ -459,14 +844,7 @@ class Database:
     def is_welcome_captcha_enabled(self, chat_id: int) -> bool:
         """Check if welcome captcha is enabled for a chat."""
         try:
-            cursor = self._execute(
-                "SELECT welcome_captcha_enabled FROM chat_settings WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            result = cursor.fetchone()
-            # Ensure we return a boolean
-            return bool(result[0]) if result else False
+            return self._get_chat_flags(chat_id)['welcome_captcha_enabled']
         except sqlite3.Error as e:
             logger.error(f"Error checking welcome captcha for chat {chat_id}: {e}")
             return False
@@ -474,29 +852,31 @@ class Database:
     def set_chat_active_status(self, chat_id: int, is_active: bool) -> bool:
         """Sets the active status of a chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                "UPDATE chat_settings SET is_active = ? WHERE chat_id = ?",
-                (1 if is_active else 0, chat_id)
-            )
-            return True
+            with self.transaction():
+                self._set_chat_flag(chat_id, 'is_active', is_active)
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting active status for chat {chat_id}: {e}")
             return False
 
     # Chat Admins Management
+    # chat_admins / whitelisted_users are mirrored in self._chat_admins / self._whitelist
+    # (loaded in _load_data); writers update the sets after the DB commit.
     def add_chat_admin(self, chat_id: int, user_id: int, added_by: int) -> bool:
         """Add a user as an admin for a specific chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                """
-                INSERT OR IGNORE INTO chat_admins (chat_id, user_id, added_by)
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, user_id, added_by)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self.get_or_create_chat(chat_id)
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO chat_admins (chat_id, user_id, added_by)
+                    VALUES (?, ?, ?)
+                    """,
+                    (chat_id, user_id, added_by)
+                )
+                added = self.cursor.rowcount > 0
+            self._chat_admins.setdefault(chat_id, set()).add(user_id)
+            return added
         except sqlite3.Error as e:
             logger.error(f"Error adding chat admin {user_id} for chat {chat_id}: {e}")
             return False
@@ -504,54 +884,43 @@ class Database:
     def remove_chat_admin(self, chat_id: int, user_id: int) -> bool:
         """Remove a user as an admin for a specific chat."""
         try:
-            self._execute(
-                "DELETE FROM chat_admins WHERE chat_id = ? AND user_id = ?",
-                (chat_id, user_id)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM chat_admins WHERE chat_id = ? AND user_id = ?",
+                    (chat_id, user_id)
+                )
+                removed = self.cursor.rowcount > 0
+            self._chat_admins.get(chat_id, set()).discard(user_id)
+            return removed
         except sqlite3.Error as e:
             logger.error(f"Error removing chat admin {user_id} for chat {chat_id}: {e}")
             return False
 
     def is_chat_admin(self, chat_id: int, user_id: int) -> bool:
         """Check if a user is a specific admin for a chat."""
-        try:
-            cursor = self._execute(
-                "SELECT 1 FROM chat_admins WHERE chat_id = ? AND user_id = ?",
-                (chat_id, user_id),
-                commit=False
-            )
-            return cursor.fetchone() is not None
-        except sqlite3.Error as e:
-            logger.error(f"Error checking chat admin status for {user_id} in {chat_id}: {e}")
-            return False
+        admins = self._chat_admins.get(chat_id)
+        return admins is not None and user_id in admins
 
     def get_chat_admins(self, chat_id: int) -> List[int]:
         """Get all specific admin user IDs for a chat."""
-        try:
-            cursor = self._execute(
-                "SELECT user_id FROM chat_admins WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            return [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            logger.error(f"Error getting chat admins for chat {chat_id}: {e}")
-            return []
+        return list(self._chat_admins.get(chat_id, ()))
 
     # Whitelist Management
     def add_whitelist_user(self, chat_id: int, user_id: int, added_by: int) -> bool:
         """Add a user to the whitelist for a specific chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                """
-                INSERT OR IGNORE INTO whitelisted_users (chat_id, user_id, added_by)
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, user_id, added_by)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self.get_or_create_chat(chat_id)
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO whitelisted_users (chat_id, user_id, added_by)
+                    VALUES (?, ?, ?)
+                    """,
+                    (chat_id, user_id, added_by)
+                )
+                added = self.cursor.rowcount > 0
+            self._whitelist.setdefault(chat_id, set()).add(user_id)
+            return added
         except sqlite3.Error as e:
             logger.error(f"Error adding whitelisted user {user_id} for chat {chat_id}: {e}")
             return False
@@ -559,69 +928,62 @@ class Database:
     def remove_whitelist_user(self, chat_id: int, user_id: int) -> bool:
         """Remove a user from the whitelist for a specific chat."""
         try:
-            self._execute(
-                "DELETE FROM whitelisted_users WHERE chat_id = ? AND user_id = ?",
-                (chat_id, user_id)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM whitelisted_users WHERE chat_id = ? AND user_id = ?",
+                    (chat_id, user_id)
+                )
+                removed = self.cursor.rowcount > 0
+            self._whitelist.get(chat_id, set()).discard(user_id)
+            return removed
         except sqlite3.Error as e:
             logger.error(f"Error removing whitelisted user {user_id} for chat {chat_id}: {e}")
             return False
 
     def is_whitelisted(self, chat_id: int, user_id: int) -> bool:
         """Check if a user is whitelisted in a specific chat."""
-        try:
-            cursor = self._execute(
-                "SELECT 1 FROM whitelisted_users WHERE chat_id = ? AND user_id = ?",
-                (chat_id, user_id),
-                commit=False
-            )
-            return cursor.fetchone() is not None
-        except sqlite3.Error as e:
-            logger.error(f"Error checking whitelist status for {user_id} in {chat_id}: {e}")
-            return False
+        whitelist = self._whitelist.get(chat_id)
+        return whitelist is not None and user_id in whitelist
 
     def get_whitelisted_users(self, chat_id: int) -> List[int]:
         """Get all whitelisted user IDs for a chat."""
-        try:
-            cursor = self._execute(
-                "SELECT user_id FROM whitelisted_users WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            return [row[0] for row in cursor.fetchall()]
-        except sqlite3.Error as e:
-            logger.error(f"Error getting whitelisted users for chat {chat_id}: {e}")
-            return []
+        return list(self._whitelist.get(chat_id, ()))
 
     # Profile check management
     def mark_user_profile_checked(self, chat_id: int, user_id: int) -> bool:
-        """Marks a user's profile as checked in a given chat."""
+        """Marks a user's profile as checked in a given chat. The write is queued and done by flush_writes."""
+        self._enqueue(_MARK_PROFILE_CHECKED_SQL, (chat_id, user_id))
+        return True
+
+    def mark_users_profile_checked(self, chat_id: int, user_ids: Iterable[int]) -> int:
+        """Marks many users' profiles as checked in one transaction. Returns the number of users marked."""
+        rows = [(chat_id, user_id) for user_id in user_ids]
+        if not rows:
+            return 0
         try:
-            self._execute(
-                """
-                INSERT INTO profile_checks (chat_id, user_id, last_check_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id, user_id) DO UPDATE SET
-                    last_check_at=CURRENT_TIMESTAMP
-                """,
-                (chat_id, user_id)
-            )
-            return True
+            with self.transaction():
+                self.cursor.executemany(_MARK_PROFILE_CHECKED_SQL, rows)
+                return len(rows)
         except sqlite3.Error as e:
-            logger.error(f"Error marking user profile as checked for {user_id} in {chat_id}: {e}")
-            return False
+            logger.error(f"Error marking {len(rows)} user profile(s) as checked in {chat_id}: {e}")
+            return 0
 
     def get_unchecked_known_members(self, chat_id: int, only_active_chat: bool = False) -> List[Dict[str, Any]]:
         """Return known active members for the chat who have not been checked yet."""
+        # Active-chat filter comes from the cached chat_settings flags instead of a subquery
+        if only_active_chat and not self._get_chat_flags(chat_id)['is_active']:
+            return []
+        self.flush_writes()
+
         query = """
-            SELECT km.user_id, km.username, km.first_name, km.last_name
-            FROM known_members as km
-            LEFT JOIN profile_checks as pc ON km.chat_id = pc.chat_id AND km.user_id = pc.user_id
-            WHERE km.chat_id = ? AND km.is_member = 1 AND pc.user_id IS NULL
+            SELECT user_id, username, first_name, last_name
+            FROM known_members AS km
+            WHERE km.chat_id = ? AND km.is_member = 1
+              AND NOT EXISTS (
+                  SELECT 1 FROM profile_checks AS pc
+                  WHERE pc.chat_id = km.chat_id AND pc.user_id = km.user_id
+              )
         """
-        if only_active_chat:
-            query += " AND km.chat_id IN (SELECT chat_id FROM chat_settings WHERE is_active = 1)"
 
         try:
             cursor = self._execute(
@@ -629,28 +991,20 @@ class Database:
                 (chat_id,),
                 commit=False
             )
-            rows = cursor.fetchall()
-            return [
-                {
-                    'user_id': r[0],
-                    'username': r[1],
-                    'first_name': r[2],
-                    'last_name': r[3],
-                }
-                for r in rows
-            ]
+            return [dict(r) for r in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error fetching unchecked known members for chat {chat_id}: {e}")
             return []
 
     def get_all_known_chat_ids(self) -> List[int]:
         """Gets all unique chat_ids from the known_members table."""
+        self.flush_writes()
         try:
             cursor = self._execute(
                 "SELECT DISTINCT chat_id FROM known_members",
                 commit=False
             )
-            return [row[0] for row in cursor.fetchall()]
+            return list(map(itemgetter(0), cursor))
         except sqlite3.Error as e:
             logger.error(f"Error getting all known chat IDs: {e}")
             return []
@@ -659,14 +1013,18 @@ class Database:
     def add_banned_avatar(self, file_unique_id: str, file_id: str, phash: str, admin_id: int) -> bool:
         """Adds a profile photo's unique ID and file ID to the banned list."""
         try:
-            self._execute(
-                """
-                INSERT OR IGNORE INTO banned_avatars (file_unique_id, file_id, phash, added_by)
-                VALUES (?, ?, ?, ?)
-                """,
-                (file_unique_id, file_id, phash, admin_id)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO banned_avatars (file_unique_id, file_id, phash, phash_int, added_by)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (file_unique_id, file_id, phash, _phash_to_sql(phash), admin_id)
+                )
+                added = self.cursor.rowcount > 0
+            self._banned_avatar_ids.add(file_unique_id)
+            self._phash_cache = None
+            return added
         except sqlite3.Error as e:
             logger.error(f"Error adding banned avatar {file_unique_id}: {e}")
             return False
@@ -674,27 +1032,22 @@ class Database:
     def remove_banned_avatar(self, file_unique_id: str) -> bool:
         """Removes a profile photo from the banned list."""
         try:
-            self._execute(
-                "DELETE FROM banned_avatars WHERE file_unique_id = ?",
-                (file_unique_id,)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM banned_avatars WHERE file_unique_id = ?",
+                    (file_unique_id,)
+                )
+                removed = self.cursor.rowcount > 0
+            self._banned_avatar_ids.discard(file_unique_id)
+            self._phash_cache = None
+            return removed
         except sqlite3.Error as e:
             logger.error(f"Error removing banned avatar {file_unique_id}: {e}")
             return False
 
     def is_avatar_banned(self, file_unique_id: str) -> bool:
         """Checks if a profile photo's unique ID is in the banned list."""
-        try:
-            cursor = self._execute(
-                "SELECT 1 FROM banned_avatars WHERE file_unique_id = ?",
-                (file_unique_id,),
-                commit=False
-            )
-            return cursor.fetchone() is not None
-        except sqlite3.Error as e:
-            logger.error(f"Error checking banned avatar status for {file_unique_id}: {e}")
-            return False
+        return file_unique_id in self._banned_avatar_ids
 
     def get_banned_avatars(self) -> List[Dict[str, Any]]:
         """Gets all banned avatar records."""
@@ -703,21 +1056,27 @@ class Database:
                 "SELECT id, file_unique_id, file_id, phash, added_by, created_at FROM banned_avatars ORDER BY created_at DESC",
                 commit=False
             )
-            return [
-                {
-                    "id": row[0],
-                    "file_unique_id": row[1],
-                    "file_id": row[2],
-                    "phash": row[3],
-                    "added_by": row[4],
-                    "created_at": row[5],
-                }
-                for row in cursor.fetchall()
-            ]
+            return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error getting banned avatars: {e}")
             return []
 
+    def get_banned_avatar_by_phash(self, packed_phash: int) -> Optional[Dict[str, Any]]:
+        """
+        Gets the banned avatar record for a hash from get_all_banned_avatar_hashes_packed,
+        via the phash_int index instead of scanning every record.
+        """
+        try:
+            signed = packed_phash - (1 << 64) if packed_phash >= (1 << 63) else packed_phash
+            row = self._fetchone(
+                "SELECT id, file_unique_id, file_id, phash, added_by, created_at FROM banned_avatars WHERE phash_int = ? LIMIT 1",
+                (signed,)
+            )
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logger.error(f"Error getting banned avatar by phash: {e}")
+            return None
+
     def get_all_banned_avatar_hashes(self) -> List[str]:
         """Gets all perceptual hashes from the banned avatars table."""
         try:
@@ -725,25 +1084,44 @@ class Database:
                 "SELECT phash FROM banned_avatars WHERE phash IS NOT NULL",
                 commit=False
             )
-            return [row[0] for row in cursor.fetchall()]
+            return list(map(itemgetter(0), cursor))
         except sqlite3.Error as e:
             logger.error(f"Error getting banned avatar hashes: {e}")
             return []
 
+    def get_all_banned_avatar_hashes_packed(self) -> Tuple[int, ...]:
+        """
+        Gets all banned perceptual hashes as unsigned 64-bit ints, so callers can compare
+        them with XOR + popcount. Read from phash_int, so no hex is parsed.
+        Cached until a banned avatar is added or removed.
+        """
+        if self._phash_cache is None:
+            try:
+                cursor = self._execute(
+                    "SELECT phash_int FROM banned_avatars WHERE phash_int IS NOT NULL",
+                    commit=False
+                )
+                self._phash_cache = tuple(value & _UINT64_MASK for (value,) in cursor)
+            except sqlite3.Error as e:
+                logger.error(f"Error getting packed banned avatar hashes: {e}")
+                return ()
+        return self._phash_cache
+
     # Bannable link domains management
     def add_bannable_domain(self, chat_id: int, domain: str, admin_id: int) -> bool:
         """Add a domain to the auto-ban list for a chat."""
         domain = domain.lower().strip()
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                """
-                INSERT OR IGNORE INTO bannable_link_domains (chat_id, domain, added_by)
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, domain, admin_id)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self.get_or_create_chat(chat_id)
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO bannable_link_domains (chat_id, domain, added_by)
+                    VALUES (?, ?, ?)
+                    """,
+                    (chat_id, domain, admin_id)
+                )
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error adding bannable domain {domain} for chat {chat_id}: {e}")
             return False
@@ -752,11 +1130,12 @@ class Database:
         """Remove a domain from the auto-ban list."""
         domain = domain.lower().strip()
         try:
-            self._execute(
-                "DELETE FROM bannable_link_domains WHERE chat_id = ? AND domain = ?",
-                (chat_id, domain)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM bannable_link_domains WHERE chat_id = ? AND domain = ?",
+                    (chat_id, domain)
+                )
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error removing bannable domain {domain} for chat {chat_id}: {e}")
             return False
@@ -769,7 +1148,7 @@ class Database:
                 (chat_id,),
                 commit=False
             )
-            return [row[0] for row in cursor.fetchall()]
+            return list(map(itemgetter(0), cursor))
         except sqlite3.Error as e:
             logger.error(f"Error getting bannable domains for chat {chat_id}: {e}")
             return []
@@ -778,20 +1157,21 @@ class Database:
     def set_chat_rules(self, chat_id: int, rules_text: str) -> bool:
         """Set or update the rules for a specific chat."""
         try:
-            # Ensure chat exists in chat_settings
-            self.get_or_create_chat(chat_id)
+            with self.transaction():
+                # Ensure chat exists in chat_settings
+                self.get_or_create_chat(chat_id)
             
-            self._execute(
-                """
-                INSERT INTO chat_rules (chat_id, rules_text, updated_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    rules_text=excluded.rules_text,
-                    updated_at=CURRENT_TIMESTAMP
-                """,
-                (chat_id, rules_text)
-            )
-            return True
+                self._execute(
+                    """
+                    INSERT INTO chat_rules (chat_id, rules_text, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        rules_text=excluded.rules_text,
+                        updated_at=CURRENT_TIMESTAMP
+                    """,
+                    (chat_id, rules_text)
+                )
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting rules for chat {chat_id}: {e}")
             return False
@@ -799,12 +1179,7 @@ class Database:
     def get_chat_rules(self, chat_id: int) -> Optional[str]:
         """Get the rules for a specific chat."""
         try:
-            cursor = self._execute(
-                "SELECT rules_text FROM chat_rules WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            result = cursor.fetchone()
+            result = self._fetchone("SELECT rules_text FROM chat_rules WHERE chat_id = ?", (chat_id,))
             return result[0] if result else None
         except sqlite3.Error as e:
             logger.error(f"Error getting rules for chat {chat_id}: {e}")
@@ -813,8 +1188,9 @@ class Database:
     def delete_chat_rules(self, chat_id: int) -> bool:
         """Delete the rules for a specific chat."""
         try:
-            self._execute("DELETE FROM chat_rules WHERE chat_id = ?", (chat_id,))
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute("DELETE FROM chat_rules WHERE chat_id = ?", (chat_id,))
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting rules for chat {chat_id}: {e}")
             return False
@@ -824,17 +1200,18 @@ class Database:
     def set_rules_ad(self, chat_id: int, ad_text: str) -> bool:
         """Sets or updates the ad text for rules for a specific chat."""
         try:
-            self.get_or_create_chat(chat_id) # Ensures foreign key constraint is met
-            self._execute(
-                """
-                INSERT INTO chat_rules (chat_id, rules_text, rules_ad_text)
-                VALUES (?, ?, ?)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    rules_ad_text=excluded.rules_ad_text
-                """,
-                (chat_id, "Правила для этого чата не установлены.", ad_text)
-            )
-            return True
+            with self.transaction():
+                self.get_or_create_chat(chat_id) # Ensures foreign key constraint is met
+                self._execute(
+                    """
+                    INSERT INTO chat_rules (chat_id, rules_ad_text)
+                    VALUES (?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        rules_ad_text=excluded.rules_ad_text
+                    """,
+                    (chat_id, ad_text)
+                )
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting rules ad for chat {chat_id}: {e}")
             return False
@@ -842,10 +1219,7 @@ class Database:
     def get_rules_ad(self, chat_id: int) -> Optional[str]:
         """Gets the ad text for rules for a specific chat."""
         try:
-            cursor = self._execute(
-                "SELECT rules_ad_text FROM chat_rules WHERE chat_id = ?", (chat_id,), commit=False
-            )
-            result = cursor.fetchone()
+            result = self._fetchone("SELECT rules_ad_text FROM chat_rules WHERE chat_id = ?", (chat_id,))
             return result[0] if result and result[0] else None
         except sqlite3.Error as e:
             logger.error(f"Error getting rules ad for chat {chat_id}: {e}")
@@ -854,12 +1228,13 @@ class Database:
     def delete_rules_ad(self, chat_id: int) -> bool:
         """Deletes the ad text for rules for a specific chat."""
         try:
-            self._execute(
-                "UPDATE chat_rules SET rules_ad_text = NULL WHERE chat_id = ?",
-                (chat_id,)
-            )
-            # We check changes because the row might not exist, which is not an error.
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "UPDATE chat_rules SET rules_ad_text = NULL WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                # We check changes because the row might not exist, which is not an error.
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting rules ad for chat {chat_id}: {e}")
             return False
@@ -869,17 +1244,18 @@ class Database:
     def set_welcome_ad(self, chat_id: int, ad_text: str) -> bool:
         """Sets or updates the ad text for the welcome message."""
         try:
-            self.get_or_create_chat(chat_id) # Ensures foreign key constraint is met
-            self._execute(
-                """
-                INSERT INTO welcome_settings (chat_id, message_text, welcome_ad_text)
-                VALUES (?, ?, ?)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    welcome_ad_text=excluded.welcome_ad_text
-                """,
-                (chat_id, "Добро пожаловать!", ad_text)
-            )
-            return True
+            with self.transaction():
+                self.get_or_create_chat(chat_id) # Ensures foreign key constraint is met
+                self._execute(
+                    """
+                    INSERT INTO welcome_settings (chat_id, welcome_ad_text)
+                    VALUES (?, ?)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        welcome_ad_text=excluded.welcome_ad_text
+                    """,
+                    (chat_id, ad_text)
+                )
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting welcome ad for chat {chat_id}: {e}")
             return False
@@ -887,10 +1263,7 @@ class Database:
     def get_welcome_ad(self, chat_id: int) -> Optional[str]:
         """Gets the ad text for the welcome message."""
         try:
-            cursor = self._execute(
-                "SELECT welcome_ad_text FROM welcome_settings WHERE chat_id = ?", (chat_id,), commit=False
-            )
-            result = cursor.fetchone()
+            result = self._fetchone("SELECT welcome_ad_text FROM welcome_settings WHERE chat_id = ?", (chat_id,))
             return result[0] if result and result[0] else None
         except sqlite3.Error as e:
             logger.error(f"Error getting welcome ad for chat {chat_id}: {e}")
@@ -899,12 +1272,13 @@ class Database:
     def delete_welcome_ad(self, chat_id: int) -> bool:
         """Deletes the ad text for the welcome message."""
         try:
-            self._execute(
-                "UPDATE welcome_settings SET welcome_ad_text = NULL WHERE chat_id = ?",
-                (chat_id,)
-            )
-            # We check changes because the row might not exist, which is not an error.
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "UPDATE welcome_settings SET welcome_ad_text = NULL WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                # We check changes because the row might not exist, which is not an error.
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting welcome ad for chat {chat_id}: {e}")
             return False
@@ -913,18 +1287,19 @@ class Database:
     def set_welcome_message(self, chat_id: int, message_text: str) -> bool:
         """Set or update the welcome message for a chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                """
-                INSERT INTO welcome_settings (chat_id, message_text, updated_at)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(chat_id) DO UPDATE SET
-                    message_text=excluded.message_text,
-                    updated_at=CURRENT_TIMESTAMP
-                """,
-                (chat_id, message_text)
-            )
-            return True
+            with self.transaction():
+                self.get_or_create_chat(chat_id)
+                self._execute(
+                    """
+                    INSERT INTO welcome_settings (chat_id, message_text, updated_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(chat_id) DO UPDATE SET
+                        message_text=excluded.message_text,
+                        updated_at=CURRENT_TIMESTAMP
+                    """,
+                    (chat_id, message_text)
+                )
+                return True
         except sqlite3.Error as e:
             logger.error(f"Error setting welcome message for chat {chat_id}: {e}")
             return False
@@ -932,13 +1307,8 @@ class Database:
     def get_welcome_message(self, chat_id: int) -> Optional[Dict[str, Any]]:
         """Get the welcome message for a chat."""
         try:
-            cursor = self._execute(
-                "SELECT message_text FROM welcome_settings WHERE chat_id = ?",
-                (chat_id,),
-                commit=False
-            )
-            result = cursor.fetchone()
-            if result:
+            result = self._fetchone("SELECT message_text FROM welcome_settings WHERE chat_id = ?", (chat_id,))
+            if result and result[0] is not None:
                 return {"text": result[0]}
             return None
         except sqlite3.Error as e:
@@ -948,8 +1318,9 @@ class Database:
     def delete_welcome_message(self, chat_id: int) -> bool:
         """Delete the welcome message for a chat."""
         try:
-            self._execute("DELETE FROM welcome_settings WHERE chat_id = ?", (chat_id,))
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute("DELETE FROM welcome_settings WHERE chat_id = ?", (chat_id,))
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error deleting welcome message for chat {chat_id}: {e}")
             return False
@@ -958,16 +1329,20 @@ class Database:
     def add_trigger(self, chat_id: int, word: str, response: str) -> bool:
         """Add a trigger for a specific chat."""
         try:
-            # Ensure chat exists
-            self.get_or_create_chat(chat_id)
+            with self.transaction():
+                # Ensure chat exists
+                self.get_or_create_chat(chat_id)
             
-            self._execute(
-                """
-                INSERT OR REPLACE INTO triggers (chat_id, trigger, response) 
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, word, response)
-            )
+                self._execute(
+                    """
+                    INSERT INTO triggers (chat_id, trigger, response) 
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(chat_id, trigger) DO UPDATE SET
+                        response=excluded.response
+                    """,
+                    (chat_id, word, response)
+                )
+            self._triggers_cache.pop(chat_id, None)
             return True
         except sqlite3.Error as e:
             logger.error(f"Error adding trigger: {e}")
@@ -976,33 +1351,46 @@ class Database:
     def remove_trigger(self, chat_id: int, word: str) -> bool:
         """Remove a trigger from a specific chat."""
         try:
-            self._execute(
-                "DELETE FROM triggers WHERE chat_id = ? AND trigger = ?",
-                (chat_id, word)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM triggers WHERE chat_id = ? AND trigger = ?",
+                    (chat_id, word)
+                )
+                removed = self.cursor.rowcount > 0
+            self._triggers_cache.pop(chat_id, None)
+            return removed
         except sqlite3.Error as e:
             logger.error(f"Error removing trigger: {e}")
             return False
 
     def get_trigger_response(self, chat_id: int, trigger: str) -> Optional[str]:
-        """Get the response for a trigger in a specific chat if it exists."""
-        try:
-            cursor = self._execute(
-                """
-                SELECT response FROM triggers 
-                WHERE chat_id = ? AND ? LIKE '%' || trigger || '%'
-                ORDER BY LENGTH(trigger) DESC
-                LIMIT 1
-                """, 
-                (chat_id, trigger),
-                commit=False
-            )
-            result = cursor.fetchone()
-            return result[0] if result else None
-        except sqlite3.Error as e:
-            logger.error(f"Error getting trigger response: {e}")
+        """
+        Get the response for a trigger in a specific chat if it exists.
+        The longest trigger contained in the text wins. The chat's triggers are
+        fetched once and compiled into a single regex, so a lookup is one scan
+        of the text instead of a LIKE scan of the table.
+        """
+        cached = self._triggers_cache.get(chat_id)
+        if cached is None:
+            try:
+                cursor = self._execute(_CHAT_TRIGGERS_SQL, (chat_id,), commit=False)
+                responses: Dict[str, str] = {}
+                for word, response in cursor:
+                    responses.setdefault(word.lower(), response)
+            except sqlite3.Error as e:
+                logger.error(f"Error getting trigger response: {e}")
+                return None
+            # Alternatives are ordered longest first and wrapped in a lookahead, so
+            # finditer yields the longest trigger starting at every position
+            pattern = re.compile(
+                "(?=(" + "|".join(map(re.escape, responses)) + "))"
+            ) if responses else None
+            cached = self._triggers_cache[chat_id] = (pattern, responses)
+        pattern, responses = cached
+        if pattern is None:
             return None
+        best = max((m.group(1) for m in pattern.finditer(trigger.lower())), key=len, default=None)
+        return responses[best] if best is not None else None
             
     def get_chat_triggers(self, chat_id: int) -> List[tuple]:
         """Get all triggers for a specific chat."""
@@ -1012,49 +1400,94 @@ class Database:
                 (chat_id,),
                 commit=False
             )
-            return cursor.fetchall()
+            return [tuple(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error getting chat triggers: {e}")
             return []
 
-    # Moderation Logging
-    def log_moderation_action(self, chat_id: Optional[int], user_id: int, action: str, admin_id: Optional[int], reason: str = None, duration: Optional[timedelta] = None) -> bool:
-        """Log a moderation action like ban, mute, warn."""
+    # Karma
+    def change_karma(self, chat_id: int, user_id: int, delta: int) -> int:
+        """
+        Add `delta` karma points to a user and return the new total.
+        The change is buffered in memory and written by flush_karma.
+        """
+        key = (chat_id, user_id)
+        self._karma_buffer[key] = self._karma_buffer.get(key, 0) + delta
+        total = self.get_user_karma(chat_id, user_id)
+        if len(self._karma_buffer) >= KARMA_FLUSH_SIZE:
+            self.flush_karma()
+        return total
+
+    def get_user_karma(self, chat_id: int, user_id: int) -> int:
+        """Get a user's karma in a chat, including changes not flushed yet."""
+        pending = self._karma_buffer.get((chat_id, user_id), 0)
         try:
-            duration_seconds = int(duration.total_seconds()) if duration else None
-            self._execute(
-                """
-                INSERT INTO moderation_logs (chat_id, user_id, action, admin_id, reason, duration_seconds)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (chat_id, user_id, action, admin_id, reason, duration_seconds)
+            cursor = self._execute(
+                "SELECT points FROM user_karma WHERE chat_id = ? AND user_id = ?",
+                (chat_id, user_id),
+                commit=False
             )
-            return True
+            result = cursor.fetchone()
+            return (result[0] if result else 0) + pending
         except sqlite3.Error as e:
-            logger.error(f"Error logging moderation action: {e}")
-            return False
+            logger.error(f"Error getting user karma: {e}")
+            return pending
+
+    def flush_karma(self) -> int:
+        """
+        Write all buffered karma changes in one transaction. Returns the number of rows written.
+        The buffer is only reduced after the commit, so a failed flush is retried by the next one.
+        """
+        if not self._karma_buffer or not self.conn:
+            return 0
+        snapshot = dict(self._karma_buffer)
+        try:
+            with self.transaction():
+                self.cursor.executemany(
+                    """
+                    INSERT INTO user_karma (chat_id, user_id, points) VALUES (?, ?, ?)
+                    ON CONFLICT(chat_id, user_id) DO UPDATE SET points = points + excluded.points
+                    """,
+                    [(chat_id, user_id, delta) for (chat_id, user_id), delta in snapshot.items()]
+                )
+        except sqlite3.Error as e:
+            logger.error(f"Error flushing karma, {len(snapshot)} change(s) kept for retry: {e}")
+            return 0
+        # Drop only what was written; changes made since the snapshot stay buffered
+        for key, delta in snapshot.items():
+            remaining = self._karma_buffer.get(key, 0) - delta
+            if remaining:
+                self._karma_buffer[key] = remaining
+            else:
+                self._karma_buffer.pop(key, None)
+        return len(snapshot)
+
+    # Moderation Logging
+    def log_moderation_action(self, chat_id: Optional[int], user_id: int, action: str, admin_id: Optional[int], reason: str = None, duration: Optional[timedelta] = None) -> bool:
+        """Log a moderation action like ban, mute, warn. The write is queued and done by flush_writes."""
+        # Whole seconds straight from the timedelta fields (no float division)
+        duration_seconds = duration.days * 86400 + duration.seconds if duration else None
+        self._enqueue(_LOG_MODERATION_SQL, (chat_id, user_id, action, admin_id, reason, duration_seconds))
+        return True
 
     def get_daily_moderation_stats(self) -> Dict[str, int]:
         """Get the count of bans and mutes in the last 24 hours."""
         stats = {'bans': 0, 'mutes': 0}
+        self.flush_writes()
         try:
-            # Get bans count
-            cursor = self._execute(
-                "SELECT COUNT(*) FROM moderation_logs WHERE action = 'ban' AND created_at >= datetime('now', '-24 hours')",
-                commit=False
-            )
-            ban_count = cursor.fetchone()
-            if ban_count:
-                stats['bans'] = ban_count[0]
-
-            # Get mutes count
+            # One pass over idx_moderation_logs_action_time for both actions
             cursor = self._execute(
-                "SELECT COUNT(*) FROM moderation_logs WHERE action = 'mute' AND created_at >= datetime('now', '-24 hours')",
+                """
+                SELECT action, COUNT(*) as count
+                FROM moderation_logs
+                WHERE action IN ('ban', 'mute') AND created_at >= ?
+                GROUP BY action
+                """,
+                (int(time.time()) - 86400,),
                 commit=False
             )
-            mute_count = cursor.fetchone()
-            if mute_count:
-                stats['mutes'] = mute_count[0]
+            for action, count in cursor.fetchall():
+                stats[f"{action}s"] = count
         except sqlite3.Error as e:
             logger.error(f"Error getting daily moderation stats: {e}")
         return stats
@@ -1068,27 +1501,40 @@ class Database:
                 username: str = None, first_name: str = None, last_name: str = None) -> bool:
         """Ban a user."""
         try:
-            # First, check if user is already banned
-            cursor = self._execute(
-                "SELECT 1 FROM banned_users WHERE user_id = ? AND is_active = 1",
-                (user_id,),
-                commit=False
-            )
-            if cursor.fetchone():
-                return False  # Already banned
-                
-            # Add to banned_users
-            self._execute(
-                """
-                INSERT INTO banned_users 
-                (user_id, username, first_name, last_name, reason, admin_id, is_active)
-                VALUES (?, ?, ?, ?, ?, ?, 1)
-                """,
-                (user_id, username, first_name, last_name, reason, admin_id)
-            )
+            with self.transaction():
+                # Insert, or re-activate a previous (unbanned) row; an active ban
+                # is left untouched, so rowcount 0 means "already banned"
+                self._execute(
+                    """
+                    INSERT INTO banned_users 
+                    (user_id, username, first_name, last_name, reason, admin_id, is_active)
+                    VALUES (?, ?, ?, ?, ?, ?, 1)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        username=excluded.username,
+                        first_name=excluded.first_name,
+                        last_name=excluded.last_name,
+                        reason=excluded.reason,
+                        admin_id=excluded.admin_id,
+                        banned_at=CURRENT_TIMESTAMP,
+                        unbanned_at=NULL,
+                        is_active=1
+                    WHERE banned_users.is_active = 0
+                    """,
+                    (user_id, username, first_name, last_name, reason, admin_id)
+                )
+                if self.cursor.rowcount == 0:
+                    return False  # Already banned
             
-            self.log_moderation_action(chat_id=None, user_id=user_id, action='ban', admin_id=admin_id, reason=reason)
+                self.log_moderation_action(chat_id=None, user_id=user_id, action='ban', admin_id=admin_id, reason=reason)
             
+            self.banned_users[user_id] = {
+                'username': username,
+                'first_name': first_name,
+                'last_name': last_name,
+                'reason': reason,
+                'admin_id': admin_id,
+                'banned_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+            }
             return True
             
         except sqlite3.Error as e:
@@ -1098,46 +1544,41 @@ class Database:
     def unban_user(self, user_id: int, admin_id: int = None) -> bool:
         """Unban a user."""
         try:
-            # Mark as inactive in banned_users
-            self._execute(
-                "UPDATE banned_users SET is_active = 0, unbanned_at = CURRENT_TIMESTAMP WHERE user_id = ? AND is_active = 1",
-                (user_id,)
-            )
+            with self.transaction():
+                # Mark as inactive in banned_users
+                self._execute(
+                    "UPDATE banned_users SET is_active = 0, unbanned_at = CURRENT_TIMESTAMP WHERE user_id = ? AND is_active = 1",
+                    (user_id,)
+                )
             
-            if self._execute("SELECT changes()").fetchone()[0] > 0:
+                if self.cursor.rowcount == 0:
+                    return False
                 self.log_moderation_action(chat_id=None, user_id=user_id, action='unban', admin_id=admin_id, reason="User unbanned by admin")
-                return True
-            return False
+            
+            self.banned_users.pop(user_id, None)
+            return True
             
         except sqlite3.Error as e:
             logger.error(f"Error unbanning user {user_id}: {e}")
             return False
         
     def is_banned(self, user_id: int) -> bool:
-        """Check if a user is currently banned."""
-        try:
-            cursor = self._execute(
-                "SELECT 1 FROM banned_users WHERE user_id = ? AND is_active = 1",
-                (user_id,),
-                commit=False
-            )
-            return cursor.fetchone() is not None
-        except sqlite3.Error as e:
-            logger.error(f"Error checking if user {user_id} is banned: {e}")
-            return False
+        """Check if a user is currently banned (answered from the in-memory ban list)."""
+        return user_id in self.banned_users
         
     # Ban patterns management
     def add_ban_pattern(self, pattern: str, description: str = None) -> bool:
         """Add a ban pattern."""
         try:
-            self._execute(
-                """
-                INSERT OR IGNORE INTO ban_patterns (pattern, description)
-                VALUES (?, ?)
-                """,
-                (pattern, description)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO ban_patterns (pattern, description)
+                    VALUES (?, ?)
+                    """,
+                    (pattern, description)
+                )
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error adding ban pattern: {e}")
             return False
@@ -1145,8 +1586,9 @@ class Database:
     def remove_ban_pattern(self, pattern: str) -> bool:
         """Remove a ban pattern."""
         try:
-            self._execute("DELETE FROM ban_patterns WHERE pattern = ?", (pattern,))
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute("DELETE FROM ban_patterns WHERE pattern = ?", (pattern,))
+                return self.cursor.rowcount > 0
         except sqlite3.Error as e:
             logger.error(f"Error removing ban pattern: {e}")
             return False
@@ -1158,8 +1600,7 @@ class Database:
                 "SELECT id, pattern, description FROM ban_patterns ORDER BY id",
                 commit=False
             )
-            return [{"id": row[0], "pattern": row[1], "description": row[2]} 
-                   for row in cursor.fetchall()]
+            return [dict(row) for row in cursor.fetchall()]
         except sqlite3.Error as e:
             logger.error(f"Error getting ban patterns: {e}")
             return []
@@ -1172,17 +1613,21 @@ class Database:
     def add_ban_word(self, chat_id: int, word: str) -> bool:
         """Add a pre-normalized word to ban list for a specific chat."""
         try:
-            # Ensure chat exists
-            self.get_or_create_chat(chat_id)
+            with self.transaction():
+                # Ensure chat exists
+                self.get_or_create_chat(chat_id)
             
-            self._execute(
-                """
-                INSERT OR IGNORE INTO ban_words (chat_id, word) 
-                VALUES (?, ?)
-                """,
-                (chat_id, word)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO ban_words (chat_id, word) 
+                    VALUES (?, ?)
+                    """,
+                    (chat_id, word)
+                )
+                changes = self.cursor.rowcount > 0
+                if changes:
+                    self._bump_ban_words_version(chat_id)
+                return changes
         except sqlite3.Error as e:
             logger.error(f"Error adding ban word: {e}")
             return False
@@ -1190,72 +1635,77 @@ class Database:
     def remove_ban_word(self, chat_id: int, word: str) -> bool:
         """Remove a pre-normalized word from ban list for a specific chat."""
         try:
-            self._execute(
-                "DELETE FROM ban_words WHERE chat_id = ? AND word = ?", 
-                (chat_id, word)
-            )
-            return self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM ban_words WHERE chat_id = ? AND word = ?", 
+                    (chat_id, word)
+                )
+                changes = self.cursor.rowcount > 0
+                if changes:
+                    self._bump_ban_words_version(chat_id)
+                return changes
         except sqlite3.Error as e:
             logger.error(f"Error removing ban word: {e}")
             return False
-        
-    def get_chat_ban_words(self, chat_id: int) -> List[str]:
-        """Get all banned words for a specific chat."""
+
+    def _bump_ban_words_version(self, chat_id: int) -> None:
+        """Invalidate the cached ban words of a chat."""
+        self._ban_words_version[chat_id] = self._ban_words_version.get(chat_id, 0) + 1
+
+    def get_ban_words_version(self, chat_id: int) -> int:
+        """Get the current version of the chat's ban word list (changes on every edit)."""
+        return self._ban_words_version.get(chat_id, 0)
+
+    def get_chat_ban_words(self, chat_id: int) -> Tuple[str, ...]:
+        """Get all banned words for a specific chat (served from memory until the list changes)."""
+        version = self._ban_words_version.get(chat_id, 0)
+        cached = self._ban_words_cache.get(chat_id)
+        if cached and cached[0] == version:
+            return cached[1]
         try:
             cursor = self._execute(
                 "SELECT word FROM ban_words WHERE chat_id = ? ORDER BY word", 
                 (chat_id,),
                 commit=False
             )
-            return [row[0] for row in cursor.fetchall()]
+            words = tuple(map(itemgetter(0), cursor))
+            self._ban_words_cache[chat_id] = (version, words)
+            return words
         except sqlite3.Error as e:
             logger.error(f"Error getting chat ban words: {e}")
-            return []
+            return ()
             
     def check_banned_word(self, chat_id: int, text: str) -> Optional[str]:
-        """Check if text contains any banned word for the chat."""
-        try:
-            cursor = self._execute(
-                """
-                SELECT word FROM ban_words 
-                WHERE chat_id = ? AND ? LIKE '%' || word || '%'
-                LIMIT 1
-                """,
-                (chat_id, text.lower()),
-                commit=False
-            )
-            result = cursor.fetchone()
-            return result[0] if result else None
-        except sqlite3.Error as e:
-            logger.error(f"Error checking banned word: {e}")
-            return None
+        """Check if text contains any banned word for the chat (scans the cached word list)."""
+        text_lower = text.lower()
+        return next((word for word in self.get_chat_ban_words(chat_id) if word in text_lower), None)
             
     def add_ban_nickname_word(self, chat_id: int, word: str, admin_id: int = None) -> bool:
         """Add a pre-normalized word to nickname ban list for a specific chat"""
         try:
-            # Ensure chat exists
-            self.get_or_create_chat(chat_id)
+            with self.transaction():
+                # Ensure chat exists
+                self.get_or_create_chat(chat_id)
             
-            # Add to database
-            self._execute(
-                """
-                INSERT OR IGNORE INTO ban_nickname_words (chat_id, word, added_by) 
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, word, admin_id)
-            )
+                # Add to database
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO ban_nickname_words (chat_id, word, added_by) 
+                    VALUES (?, ?, ?)
+                    """,
+                    (chat_id, word, admin_id)
+                )
+            
+                changes = self.cursor.rowcount > 0
             
-            changes = self._execute("SELECT changes()").fetchone()[0] > 0
+                if changes:
+                    # Log the action in the same transaction
+                    self._log_ban_word_action(chat_id, 'nickname', word, 'add', admin_id)
             
             if changes:
-                # Update in-memory cache
-                if chat_id not in self.ban_nickname_words:
-                    self.ban_nickname_words[chat_id] = set()
-                self.ban_nickname_words[chat_id].add(word)
-                
-                # Log the action
-                self._log_ban_word_action(chat_id, 'nickname', word, 'add', admin_id)
-                
+                # Update in-memory cache only once the insert is committed
+                self.ban_nickname_words.setdefault(chat_id, set()).add(word)
+                self._nick_re.pop(chat_id, None)
             return changes
             
         except sqlite3.Error as e:
@@ -1265,17 +1715,21 @@ class Database:
     def remove_ban_nickname_word(self, chat_id: int, word: str, admin_id: int = None) -> bool:
         """Remove a pre-normalized word from nickname ban list for a specific chat"""
         try:
-            self._execute(
-                "DELETE FROM ban_nickname_words WHERE chat_id = ? AND word = ?", 
-                (chat_id, word)
-            )
-            changes = self._execute("SELECT changes()").fetchone()[0] > 0
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM ban_nickname_words WHERE chat_id = ? AND word = ?", 
+                    (chat_id, word)
+                )
+                changes = self.cursor.rowcount > 0
             
-            if changes and chat_id in self.ban_nickname_words and word in self.ban_nickname_words[chat_id]:
-                self.ban_nickname_words[chat_id].remove(word)
-                # Log the action
-                self._log_ban_word_action(chat_id, 'nickname', word, 'remove', admin_id)
-                
+                if changes:
+                    # Log the action in the same transaction
+                    self._log_ban_word_action(chat_id, 'nickname', word, 'remove', admin_id)
+            
+            if changes:
+                # Update in-memory cache only once the delete is committed
+                self.ban_nickname_words.get(chat_id, set()).discard(word)
+                self._nick_re.pop(chat_id, None)
             return changes
             
         except sqlite3.Error as e:
@@ -1296,7 +1750,7 @@ class Database:
                     "SELECT DISTINCT word FROM ban_nickname_words ORDER BY word",
                     commit=False
                 )
-            return [row[0] for row in cursor.fetchall()]
+            return list(map(itemgetter(0), cursor))
         except sqlite3.Error as e:
             logger.error(f"Error getting ban nickname words: {e}")
             return []
@@ -1304,13 +1758,14 @@ class Database:
     def _log_ban_word_action(self, chat_id: int, word_type: str, word: str, action: str, admin_id: int = None) -> None:
         """Log ban word actions"""
         try:
-            self._execute(
-                """
-                INSERT INTO ban_word_logs (chat_id, word_type, word, action, admin_id)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (chat_id, word_type, word, action, admin_id)
-            )
+            with self.transaction():
+                self._execute(
+                    """
+                    INSERT INTO ban_word_logs (chat_id, word_type, word, action, admin_id)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (chat_id, word_type, word, action, admin_id)
+                )
         except sqlite3.Error as e:
             logger.error(f"Error logging ban word action: {e}")
 
@@ -1325,57 +1780,36 @@ class Database:
         # Convert both the username and banned words to lowercase for case-insensitive comparison
         username_lower = username.lower()
         
-        # Check in memory cache first
-        if chat_id in self.ban_nickname_words:
-            for word in self.ban_nickname_words[chat_id]:
-                word_lower = word.lower()
-                # Check for word as substring
-                if word_lower in username_lower:
-                    return word
-                # Also check for word with non-word characters
-                if not word_lower.isalnum() and word_lower in username_lower:
-                    return word
-        
-        # If not found in cache, check database and update cache
-        try:
-            cursor = self._execute(
-                """
-                SELECT word FROM ban_nickname_words 
-                WHERE chat_id = ? AND LOWER(?) LIKE '%' || LOWER(word) || '%' 
-                LIMIT 1
-                """,
-                (chat_id, username_lower),
-                commit=False
-            )
-            result = cursor.fetchone()
-            if result:
-                # Update cache
-                if chat_id not in self.ban_nickname_words:
-                    self.ban_nickname_words[chat_id] = set()
-                self.ban_nickname_words[chat_id].add(result[0])
-                return result[0]
-            return None
-            
-        except sqlite3.Error as e:
-            logger.error(f"Error checking banned nickname: {e}")
+        # The in-memory sets are loaded at startup and kept in step by
+        # add_ban_nickname_word/remove_ban_nickname_word, so no database fallback
+        cached = self._nick_re.get(chat_id)
+        if cached is None:
+            words = {word.lower(): word for word in self.ban_nickname_words.get(chat_id, ())}
+            pattern = re.compile("|".join(map(re.escape, words))) if words else None
+            cached = self._nick_re[chat_id] = (pattern, words)
+        pattern, words = cached
+        if pattern is None:
             return None
+        match = pattern.search(username_lower)
+        return words[match.group(0)] if match else None
 
     # Ban bio words management
     def add_ban_bio_word(self, chat_id: int, word: str, admin_id: int = None) -> bool:
         """Add a pre-normalized word to bio ban list for a specific chat."""
         try:
-            self.get_or_create_chat(chat_id)
-            self._execute(
-                """
-                INSERT OR IGNORE INTO ban_bio_words (chat_id, word, added_by)
-                VALUES (?, ?, ?)
-                """,
-                (chat_id, word, admin_id)
-            )
-            changes = self._execute("SELECT changes()").fetchone()[0] > 0
-            if changes:
-                self._log_ban_word_action(chat_id, 'bio', word, 'add', admin_id)
-            return changes
+            with self.transaction():
+                self.get_or_create_chat(chat_id)
+                self._execute(
+                    """
+                    INSERT OR IGNORE INTO ban_bio_words (chat_id, word, added_by)
+                    VALUES (?, ?, ?)
+                    """,
+                    (chat_id, word, admin_id)
+                )
+                changes = self.cursor.rowcount > 0
+                if changes:
+                    self._log_ban_word_action(chat_id, 'bio', word, 'add', admin_id)
+                return changes
         except sqlite3.Error as e:
             logger.error(f"Error adding ban bio word: {e}")
             return False
@@ -1383,14 +1817,15 @@ class Database:
     def remove_ban_bio_word(self, chat_id: int, word: str, admin_id: int = None) -> bool:
         """Remove a pre-normalized word from bio ban list for a specific chat."""
         try:
-            self._execute(
-                "DELETE FROM ban_bio_words WHERE chat_id = ? AND word = ?",
-                (chat_id, word)
-            )
-            changes = self._execute("SELECT changes()").fetchone()[0] > 0
-            if changes:
-                self._log_ban_word_action(chat_id, 'bio', word, 'remove', admin_id)
-            return changes
+            with self.transaction():
+                self._execute(
+                    "DELETE FROM ban_bio_words WHERE chat_id = ? AND word = ?",
+                    (chat_id, word)
+                )
+                changes = self.cursor.rowcount > 0
+                if changes:
+                    self._log_ban_word_action(chat_id, 'bio', word, 'remove', admin_id)
+                return changes
         except sqlite3.Error as e:
             logger.error(f"Error removing ban bio word: {e}")
             return False
@@ -1403,7 +1838,7 @@ class Database:
                 (chat_id,),
                 commit=False
             )
-            return [row[0] for row in cursor.fetchall()]
+            return list(map(itemgetter(0), cursor))
         except sqlite3.Error as e:
             logger.error(f"Error getting ban bio words for chat {chat_id}: {e}")
             return []
@@ -1411,6 +1846,7 @@ class Database:
     def get_user_global_punishment_stats(self, user_id: int) -> Dict[str, int]:
         """Gets the total count of punishments (bans, mutes, warns) for a user across all chats."""
         stats = {'bans': 0, 'mutes': 0, 'warns': 0, 'total': 0}
+        self.flush_writes()
         try:
             cursor = self._execute(
                 """
@@ -1433,24 +1869,43 @@ class Database:
 
     def get_user_join_date(self, chat_id: int, user_id: int) -> Optional[str]:
         """Gets the join date (created_at) for a user in a specific chat."""
+        if (chat_id, user_id) in self._member_buffer:
+            self.flush_writes()
         try:
-            cursor = self._execute(
+            result = self._fetchone(
                 "SELECT created_at FROM known_members WHERE chat_id = ? AND user_id = ?",
-                (chat_id, user_id),
-                commit=False
+                (chat_id, user_id)
             )
-            result = cursor.fetchone()
             return result[0] if result else None
         except sqlite3.Error as e:
             logger.error(f"Error getting join date for user {user_id} in chat {chat_id}: {e}")
             return None
 
-# Global database instance
-db = Database()
-
-# Run data migration on import
-try:
-    db.migrate_old_data()
-except Exception as e:
-    logger.error(f"Error during initial data migration: {e}")
-    # Continue with empty database if migration fails
+@functools.lru_cache(maxsize=1)
+def get_db() -> Database:
+    """Create the shared Database on first use and run the legacy data migration once."""
+    database = Database()
+    try:
+        database.migrate_old_data()
+    except Exception as e:
+        logger.error(f"Error during initial data migration: {e}")
+        # Continue with empty database if migration fails
+    return database
+
+
+class _LazyDatabase:
+    """
+    Stand-in for the global `db`: importing this module no longer creates tables,
+    loads caches or migrates data; that happens on the first attribute access.
+    Methods are cached on the proxy, so later calls cost a plain attribute lookup.
+    """
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(get_db(), name)
+        if callable(value):
+            setattr(self, name, value)
+        return value
+
+
+# Global database instance (created lazily, see get_db)
+db = _LazyDatabase()
@@ -1,3 +1,4 @@
+import atexit
 import sqlite3
 import os
 from pathlib import Path
@@ -11,6 +12,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Stored in PRAGMA user_version once Database._migrate_schema has run. Bump it
+# whenever _migrate_schema gains a step or the DDL below changes, so existing
+# databases go through the full initialization again.
+SCHEMA_VERSION = 7
+
 class DatabaseSchema:
     def __init__(self, db_path: str = 'bot_database1.db'):
         """Initialize the database connection and create tables if they don't exist."""
@@ -19,12 +25,36 @@ class DatabaseSchema:
         self.db_path = Path(env_db_path) if env_db_path else Path(db_path)
         self.conn = None
         self._initialize_database()
+        # Close deterministically at interpreter exit instead of relying on __del__
+        atexit.register(self.close)
         
     def _initialize_database(self):
         """Create database tables if they don't exist."""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            # Larger prepared-statement cache: every Database helper uses static SQL
+            self.conn = sqlite3.connect(self.db_path, cached_statements=256)
+            # Must be set before the first table is created to take effect; lets
+            # Database.incremental_vacuum return free pages without a full VACUUM
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self._tune_connection()
             cursor = self.conn.cursor()
+            # Fast path: an up-to-date database already has every table and index
+            if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                logger.info("Database schema is up to date")
+                return
+            # Run the whole DDL block in one transaction: a single journal sync
+            # instead of one per statement, and no half-initialized schema on error
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # Columns of every table that may need a migration, read in one query
+            # before any DDL runs (a missing table has no entry)
+            columns_by_table: Dict[str, set] = {}
+            for table, column in cursor.execute(
+                "SELECT m.name, p.name FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+                "WHERE m.type = 'table' AND m.name IN (?, ?, ?, ?, ?)",
+                ('ban_words', 'ban_nickname_words', 'chat_settings', 'banned_avatars', 'triggers')
+            ):
+                columns_by_table.setdefault(table, set()).add(column)
             
             # Create ban_words table (now with chat_id)
             cursor.execute('''
@@ -39,8 +69,7 @@ class DatabaseSchema:
             ''')
             
             # First, check if ban_nickname_words exists and needs migration
-            cursor.execute("PRAGMA table_info(ban_nickname_words)")
-            columns = [col[1] for col in cursor.fetchall()]
+            columns = columns_by_table.get('ban_nickname_words')
             
             if not columns:  # Table doesn't exist, create new
                 cursor.execute('''
@@ -170,8 +199,7 @@ class DatabaseSchema:
             )''')
             
             # Add delete_links_enabled column to chat_settings if it doesn't exist
-            cursor.execute("PRAGMA table_info(chat_settings)")
-            chat_settings_columns = [col[1] for col in cursor.fetchall()]
+            chat_settings_columns = columns_by_table.get('chat_settings', set())
             if 'delete_links_enabled' not in chat_settings_columns:
                 cursor.execute('ALTER TABLE chat_settings ADD COLUMN delete_links_enabled BOOLEAN DEFAULT 0')
             
@@ -224,7 +252,7 @@ class DatabaseSchema:
                 reason TEXT,
                 duration_seconds INTEGER,
                 admin_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
             ''')
 
@@ -233,25 +261,37 @@ class DatabaseSchema:
             CREATE TABLE IF NOT EXISTS banned_avatars (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 file_unique_id TEXT NOT NULL UNIQUE,
+                file_id TEXT,
                 phash TEXT,
+                phash_int INTEGER,
                 added_by INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
             ''')
 
-            # Add phash column to banned_avatars if it doesn't exist
-            cursor.execute("PRAGMA table_info(banned_avatars)")
-            banned_avatars_columns = [col[1] for col in cursor.fetchall()]
-            if 'phash' not in banned_avatars_columns:
-                cursor.execute('ALTER TABLE banned_avatars ADD COLUMN phash TEXT')
-            if 'file_id' not in banned_avatars_columns:
-                cursor.execute('ALTER TABLE banned_avatars ADD COLUMN file_id TEXT')
+            # Add phash column to banned_avatars if it doesn't exist (a table created
+            # just above already has every column)
+            banned_avatars_columns = columns_by_table.get('banned_avatars')
+            if banned_avatars_columns is not None:
+                if 'phash' not in banned_avatars_columns:
+                    cursor.execute('ALTER TABLE banned_avatars ADD COLUMN phash TEXT')
+                if 'file_id' not in banned_avatars_columns:
+                    cursor.execute('ALTER TABLE banned_avatars ADD COLUMN file_id TEXT')
 
             # Create new triggers table with chat_id
             # Migrate triggers to include chat_id ONLY if old schema lacks chat_id
-            cursor.execute("PRAGMA table_info(triggers)")
-            trig_columns = [col[1] for col in cursor.fetchall()]
-            if 'chat_id' not in trig_columns:
+            trig_columns = columns_by_table.get('triggers')
+            if trig_columns is None:  # Table doesn't exist, create new
+                cursor.execute('''
+                CREATE TABLE triggers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL DEFAULT 0,
+                    trigger TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(chat_id, trigger)
+                )''')
+            elif 'chat_id' not in trig_columns:
                 cursor.execute('''
                 CREATE TABLE IF NOT EXISTS triggers_new (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -272,9 +312,9 @@ class DatabaseSchema:
                 cursor.execute('ALTER TABLE triggers_new RENAME TO triggers')
             
             # Migrate ban_words to include chat_id ONLY if old schema lacks chat_id
-            cursor.execute("PRAGMA table_info(ban_words)")
-            bw_columns = [col[1] for col in cursor.fetchall()]
-            if 'chat_id' not in bw_columns:
+            # (a table created at the top of this block already has it)
+            bw_columns = columns_by_table.get('ban_words')
+            if bw_columns is not None and 'chat_id' not in bw_columns:
                 cursor.execute('''
                 CREATE TABLE IF NOT EXISTS ban_words_new (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -293,26 +333,16 @@ class DatabaseSchema:
                 cursor.execute('ALTER TABLE ban_words RENAME TO ban_words_old')
                 cursor.execute('ALTER TABLE ban_words_new RENAME TO ban_words')
             
-            # Create indexes
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_triggers_chat_id ON triggers(chat_id)')
-            
-            # Create indexes for better performance
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_words_chat_word ON ban_words(chat_id, word)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_nickname_words_chat_word ON ban_nickname_words(chat_id, word)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_bio_words_chat_word ON ban_bio_words(chat_id, word)')
+            # Create indexes for better performance. Lookups by (chat_id, word),
+            # (chat_id, user_id) etc. use the UNIQUE constraints' own indexes, which
+            # also carry the rowid, so they are covering without a separate index.
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_word_logs_chat ON ban_word_logs(chat_id, word_type, word)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_word_logs_created ON ban_word_logs(created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_banned_users_user_id ON banned_users(user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_banned_users_is_active ON banned_users(is_active)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_triggers_trigger ON triggers(trigger)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_known_members_chat_user ON known_members(chat_id, user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_bannable_domains_chat_domain ON bannable_link_domains(chat_id, domain)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_admins_chat_user ON chat_admins(chat_id, user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_whitelisted_users_chat_user ON whitelisted_users(chat_id, user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_action_time ON moderation_logs(action, created_at)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_banned_avatars_unique_id ON banned_avatars(file_unique_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_user_action ON moderation_logs(user_id, action)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_known_members_last_seen ON known_members(last_seen)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_banned_avatars_phash ON banned_avatars(phash)')
             
             self.conn.commit()
             logger.info("Database schema initialized successfully")
@@ -323,14 +353,33 @@ class DatabaseSchema:
                 self.conn.rollback()
             raise
     
+    def _tune_connection(self):
+        """
+        Set connection-wide PRAGMAs before the schema DDL runs.
+        WAL lets readers and the writer proceed without blocking each other and commits
+        without a full journal fsync; it requires the DB file to be on a local filesystem.
+        """
+        # An in-memory database has no journal file to switch
+        if str(self.db_path) != ':memory:':
+            mode = self.conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if str(mode).lower() != 'wal':
+                logger.warning(f"Could not enable WAL journaling, SQLite kept journal_mode={mode}")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA temp_store = MEMORY")
+        self.conn.execute("PRAGMA cache_size = -64000")  # ~64 MiB
+        self.conn.execute("PRAGMA mmap_size = 268435456")  # 256 MiB
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+
     def close(self):
         """Close the database connection."""
         if self.conn:
             self.conn.close()
             self.conn = None
     
-    def __del__(self):
-        """Ensure the database connection is closed when the object is destroyed."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
         self.close()
 
 # Create a global instance of the database schema
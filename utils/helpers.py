@@ -1,6 +1,8 @@
+import heapq
 import logging
+import time
 from typing import Union, Dict
-from collections import deque
+from collections import deque, OrderedDict
 from telegram.ext import JobQueue, ContextTypes
 from telegram import Update
 from telegram.constants import ChatType
@@ -11,30 +13,88 @@ from utils.text_utils import normalize_text
 
 logger = logging.getLogger(__name__)
 
-async def _delete_message_job(context: ContextTypes.DEFAULT_TYPE):
+# Hashed once at import; ADMIN_IDS itself stays a list for ordered iteration
+_ADMIN_IDS = frozenset(ADMIN_IDS)
+
+# Pending deletions live in one heap of (deadline, chat_id, message_id) in bot_data,
+# swept by a single repeating job instead of one JobQueue job per message.
+PENDING_DELETIONS_KEY = '_pending_deletions'
+DELETION_SWEEP_INTERVAL = 1.0
+
+async def _sweep_deletions_job(context: ContextTypes.DEFAULT_TYPE):
     """
-    Job to delete a message.
+    Job that deletes every queued message whose deadline has passed.
     """
-    job = context.job
-    chat_id = job.data['chat_id']
-    message_id = job.data['message_id']
-    try:
-        await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.debug(f"Successfully deleted message {message_id} in chat {chat_id} via job.")
-    except Exception as e:
-        logger.warning(f"Could not delete message {message_id} in chat {chat_id} via job: {e}")
+    pending = context.bot_data.get(PENDING_DELETIONS_KEY)
+    if not pending:
+        return
+    now = time.monotonic()
+    while pending and pending[0][0] <= now:
+        _, chat_id, message_id = heapq.heappop(pending)
+        try:
+            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            logger.debug(f"Successfully deleted message {message_id} in chat {chat_id} via job.")
+        except Exception as e:
+            logger.warning(f"Could not delete message {message_id} in chat {chat_id} via job: {e}")
 
-def schedule_message_deletion(job_queue: JobQueue, chat_id: Union[int, str], message_id: int, delay: int = 10):
-    """Schedules a message to be deleted after a delay using the JobQueue."""
-    job_queue.run_once(
-        _delete_message_job,
-        when=delay,
-        data={'chat_id': chat_id, 'message_id': message_id},
-        name=f"delete-{chat_id}-{message_id}"
+def register_deletion_sweeper(job_queue: JobQueue):
+    """Starts the recurring job that serves schedule_message_deletion."""
+    job_queue.run_repeating(
+        _sweep_deletions_job,
+        interval=DELETION_SWEEP_INTERVAL,
+        first=DELETION_SWEEP_INTERVAL,
+        name="delete-sweeper"
     )
 
+def schedule_message_deletion(job_queue: JobQueue, chat_id: Union[int, str], message_id: int, delay: int = 10):
+    """Queues a message to be deleted after a delay (see register_deletion_sweeper)."""
+    pending = job_queue.application.bot_data.setdefault(PENDING_DELETIONS_KEY, [])
+    heapq.heappush(pending, (time.monotonic() + delay, chat_id, message_id))
+
+class LRUDict(OrderedDict):
+    """A dict that evicts its oldest entries once it grows beyond `maxsize`."""
+
+    def __init__(self, maxsize: int = 512, *args, **kwargs):
+        self.maxsize = maxsize
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if len(self) > self.maxsize:
+            del self[next(iter(self))]
+
+class BoundedSet:
+    """
+    Keeps the last `maxlen` distinct items in insertion order. A deque tracks the
+    order and a set shadows it, so membership checks are O(1).
+    """
+    __slots__ = ('_order', '_items')
+
+    def __init__(self, maxlen: int):
+        self._order = deque(maxlen=maxlen)
+        self._items = set()
+
+    def add(self, item) -> None:
+        if item in self._items:
+            return
+        order = self._order
+        evicted = order[0] if len(order) == order.maxlen else None
+        order.append(item)
+        self._items.add(item)
+        if evicted is not None:
+            self._items.discard(evicted)
+
+    def __contains__(self, item) -> bool:
+        return item in self._items
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self):
+        return iter(self._order)
+
 # --- Bot Message Cache for Mimicry Detection ---
-bot_message_cache: Dict[int, deque] = {}
+bot_message_cache: Dict[int, BoundedSet] = {}
 BOT_MESSAGE_CACHE_SIZE = 20  # Store last 20 messages per chat
 
 def add_bot_message_to_cache(chat_id: int, text: str):
@@ -42,33 +102,35 @@ def add_bot_message_to_cache(chat_id: int, text: str):
     if not text:
         return
     if chat_id not in bot_message_cache:
-        bot_message_cache[chat_id] = deque(maxlen=BOT_MESSAGE_CACHE_SIZE)
+        bot_message_cache[chat_id] = BoundedSet(BOT_MESSAGE_CACHE_SIZE)
     
     normalized_text = normalize_text(text)
-    if normalized_text and normalized_text not in bot_message_cache[chat_id]:
-        bot_message_cache[chat_id].append(normalized_text)
+    if normalized_text:
+        bot_message_cache[chat_id].add(normalized_text)
 
 async def is_global_admin(user_id: int) -> bool:
     """Checks if a user is a global bot admin."""
-    return user_id in ADMIN_IDS
+    return user_id in _ADMIN_IDS
 
 async def is_admin(update: Update) -> bool:
     """
     Checks if a user has admin privileges for the bot in the current context.
     This is true if they are a global admin or a chat-specific admin.
+    Every check is an in-memory lookup, so nothing below is awaited.
     """
-    if not update.effective_user:
+    user = update.effective_user
+    if not user:
         return False
     
-    user_id = update.effective_user.id
+    user_id = user.id
 
-    # 1. Global admins have access everywhere
-    if await is_global_admin(user_id):
+    # 1. Global admins have access everywhere (inlined is_global_admin: no coroutine)
+    if user_id in _ADMIN_IDS:
         return True
     
-    # 2. Check for chat-specific admin in the database if in a group
-    if update.effective_chat and update.effective_chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]:
-        if db.is_chat_admin(update.effective_chat.id, user_id):
-            return True
+    # 2. Check for chat-specific admin if in a group
+    chat = update.effective_chat
+    if chat and chat.type in (ChatType.GROUP, ChatType.SUPERGROUP):
+        return db.is_chat_admin(chat.id, user_id)
 
     return False
@@ -1,6 +1,8 @@
+import asyncio
 import logging
+from collections import OrderedDict
 from io import BytesIO
-from typing import Optional, Any
+from typing import Optional, Any, Iterable
 
 try:
     from PIL import Image, UnidentifiedImageError
@@ -21,37 +23,93 @@ if PIL_AVAILABLE:
 
 logger = logging.getLogger(__name__)
 
-async def calculate_phash(image_bytes: bytes) -> Optional[str]:
+# --- Prewarm at import ---
+# Pillow registers its format plugins and imagehash imports scipy's FFT lazily, on the
+# first decode / phash. Pay that once here instead of inside the first avatar check.
+if PIL_AVAILABLE:
+    try:
+        Image.preinit()
+        from PIL import WebPImagePlugin  # noqa: F401
+    except ImportError:
+        pass  # Pillow built without WebP
+    try:
+        imagehash.phash(Image.new('L', (32, 32)))
+    except Exception as e:
+        logger.warning(f"Could not prewarm imagehash: {e}")
+
+# LRU of file_unique_id -> phash. Telegram's file_unique_id is stable for the same
+# file, and phash is deterministic, so a hit can skip the download and decode entirely.
+PHASH_CACHE_SIZE = 10000
+_PHASH_CACHE: "OrderedDict[str, str]" = OrderedDict()
+
+def get_cached_phash(file_unique_id: Optional[str]) -> Optional[str]:
+    """Returns the cached phash for a file_unique_id, or None if it was not hashed yet."""
+    if not file_unique_id:
+        return None
+    phash = _PHASH_CACHE.get(file_unique_id)
+    if phash is not None:
+        _PHASH_CACHE.move_to_end(file_unique_id)
+    return phash
+
+def _cache_phash(file_unique_id: str, phash: str) -> None:
+    _PHASH_CACHE[file_unique_id] = phash
+    _PHASH_CACHE.move_to_end(file_unique_id)
+    if len(_PHASH_CACHE) > PHASH_CACHE_SIZE:
+        _PHASH_CACHE.popitem(last=False)
+
+# Caps concurrent decodes (and the image buffers they hold) during join bursts
+PHASH_MAX_CONCURRENCY = 4
+_PHASH_SEMAPHORE = asyncio.Semaphore(PHASH_MAX_CONCURRENCY)
+
+async def calculate_phash(image_bytes: bytes, file_unique_id: Optional[str] = None) -> Optional[str]:
     """
     Calculates the perceptual hash (phash) of an image.
-    This version is more robust and handles different image modes.
+    The decode and hash run in a worker thread so the event loop is not blocked.
+    If file_unique_id is given, the result is memoized under it.
     Returns the hash as a string, or None if it fails.
     """
+    cached = get_cached_phash(file_unique_id)
+    if cached is not None:
+        return cached
+
     if not PIL_AVAILABLE:
         logger.warning("Pillow or imagehash library not installed. Cannot calculate image hash.")
         return None
 
+    async with _PHASH_SEMAPHORE:
+        phash = await asyncio.to_thread(_calculate_phash_sync, image_bytes)
+    # The LRU is only touched from the event loop, never from the worker thread
+    if phash and file_unique_id:
+        _cache_phash(file_unique_id, phash)
+    return phash
+
+def _calculate_phash_sync(image_bytes: bytes) -> Optional[str]:
+    """
+    Blocking part of calculate_phash.
+    This version is more robust and handles different image modes.
+    """
     try:
         image = Image.open(BytesIO(image_bytes))
 
+        # phash only looks at a 32x32 grayscale, so shrink first: every step
+        # below then touches a 64x64 image instead of the full-size avatar.
+        image.thumbnail((64, 64), RESAMPLING_METHOD)
+
         # --- Robust image handling ---
         # 1. If the image has an alpha channel (e.g., PNG, WEBP with transparency),
-        #    convert it to RGB by pasting it on a white background.
+        #    flatten it onto a white background in a single composite.
         if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
-            # Create a white background
-            background = Image.new('RGB', image.size, (255, 255, 255))
-            # Paste the image on top of the background, using its alpha channel as a mask
-            background.paste(image, mask=image.convert('RGBA').split()[3])
-            image = background
-        # 2. If it's not RGB, convert it. This handles palette-based images etc.
-        elif image.mode != 'RGB':
+            background = Image.new('RGBA', image.size, (255, 255, 255, 255))
+            image = Image.alpha_composite(background, image.convert('RGBA'))
+        # 2. Opaque RGB/L images (JPEG avatars) skip this; other modes (CMYK, etc.)
+        #    still go through RGB before the grayscale conversion.
+        elif image.mode not in ('RGB', 'L'):
             image = image.convert('RGB')
 
         # phash works on grayscale images.
         grayscale_image = image.convert("L")
         
-        phash = imagehash.phash(grayscale_image)
-        return str(phash)
+        return str(imagehash.phash(grayscale_image))
         
     except UnidentifiedImageError:
         logger.error("Cannot identify image file. It might be corrupted or in an unsupported format (e.g., HEIC).")
@@ -65,14 +123,32 @@ def compare_phashes(hash1_str: str, hash2_str: str, threshold: int) -> bool:
     Compares two phash hex strings and returns True if their difference
     is within the threshold.
     """
-    if not PIL_AVAILABLE or not hash1_str or not hash2_str:
+    if not hash1_str or not hash2_str:
         return False
         
     try:
-        hash1 = imagehash.hex_to_hash(hash1_str)
-        hash2 = imagehash.hex_to_hash(hash2_str)
-        
-        return (hash1 - hash2) <= threshold
+        # A 64-bit phash fits in an int: Hamming distance is XOR + popcount
+        distance = (int(hash1_str, 16) ^ int(hash2_str, 16)).bit_count()
+        return distance <= threshold
     except (ValueError, TypeError) as e:
         logger.error(f"Error comparing phashes ('{hash1_str}', '{hash2_str}'): {e}")
-        return False
\ No newline at end of file
+        return False
+
+def find_similar_phash(phash_str: str, packed_hashes: Iterable[int], threshold: int) -> Optional[int]:
+    """
+    Returns the first hash from packed_hashes (phashes decoded to ints) whose
+    Hamming distance to phash_str is within the threshold, or None.
+    """
+    if not phash_str:
+        return None
+
+    try:
+        value = int(phash_str, 16)
+    except (ValueError, TypeError) as e:
+        logger.error(f"Error decoding phash '{phash_str}': {e}")
+        return None
+
+    for banned in packed_hashes:
+        if (value ^ banned).bit_count() <= threshold:
+            return banned
+    return None
@@ -0,0 +1,31 @@
+import logging
+from typing import Any, Dict
+
+from telegram.request import HTTPXRequest
+
+# orjson is optional; without it the bot uses PTB's default request class
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Same shape as PTB's JSONDict, without importing from its private telegram._utils
+JSONDict = Dict[str, Any]
+
+
+class OrjsonHTTPXRequest(HTTPXRequest):
+    """
+    HTTPXRequest that parses Bot API responses with orjson.
+    Every API call (getUpdates included) goes through parse_json_payload, so this
+    speeds up decoding for the whole bot. Payloads orjson rejects (e.g. invalid
+    UTF-8) are handed to the default parser, which keeps PTB's error handling.
+    """
+
+    def parse_json_payload(self, payload: bytes) -> JSONDict:
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            return super().parse_json_payload(payload)
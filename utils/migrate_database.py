@@ -10,6 +10,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Rows copied per transaction, so the rollback journal stays bounded on big tables
+MIGRATION_BATCH_SIZE = 10000
+
 def migrate_database(db_path: str = 'bot_database1.db') -> None:
     """
     Migrate the database to the latest schema.
@@ -18,11 +21,11 @@ def migrate_database(db_path: str = 'bot_database1.db') -> None:
         db_path: Path to the SQLite database file
     """
     db_path = Path(db_path)
-    backup_path = db_path.with_suffix('.bak' + db_path.suffix)
     
     try:
-        # Connect to the database
-        conn = sqlite3.connect(str(db_path))
+        # Connect to the database; isolation_level=None so the explicit BEGIN below
+        # is the only transaction
+        conn = sqlite3.connect(str(db_path), isolation_level=None)
         cursor = conn.cursor()
         
         logger.info("Starting database migration...")
@@ -31,20 +34,14 @@ def migrate_database(db_path: str = 'bot_database1.db') -> None:
         cursor.execute("PRAGMA table_info(ban_nickname_words)")
         columns = [col[1] for col in cursor.fetchall()]
         
-        if 'chat_id' not in columns:
+        if columns and 'chat_id' not in columns:
             logger.info("Migrating ban_nickname_words table...")
             
-            # Create backup of the database
-            logger.info("Creating database backup...")
-            if backup_path.exists():
-                backup_path.unlink()
-            db_path.rename(backup_path)
-            
-            # Reconnect to the new database
-            conn.close()
-            backup_path.rename(db_path)
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
+            # Bulk-copy settings for the migration window only. The rollback journal
+            # stays on, so a failed batch still rolls back cleanly.
+            cursor.execute('PRAGMA synchronous = OFF')
+            cursor.execute('PRAGMA temp_store = MEMORY')
+            cursor.execute('PRAGMA cache_size = -262144')
             
             # Create new table with chat_id
             cursor.execute('''
@@ -57,30 +54,44 @@ def migrate_database(db_path: str = 'bot_database1.db') -> None:
                 UNIQUE(chat_id, word)
             )''')
             
-            # Migrate existing data
-            cursor.execute('''
-            INSERT OR IGNORE INTO ban_nickname_words_new (word, added_by, created_at)
-            SELECT word, NULL, COALESCE(created_at, CURRENT_TIMESTAMP) 
-            FROM ban_nickname_words
-            ''')
+            # Migrate existing data in rowid-keyed batches, one transaction each. The old
+            # table stays in place until the swap below, and UNIQUE(chat_id, word) with
+            # INSERT OR IGNORE makes an interrupted run safe to restart.
+            last_rowid = 0
+            while True:
+                cursor.execute('BEGIN EXCLUSIVE')
+                upper = cursor.execute('''
+                SELECT MAX(rowid) FROM (
+                    SELECT rowid FROM ban_nickname_words WHERE rowid > ? ORDER BY rowid LIMIT ?
+                )''', (last_rowid, MIGRATION_BATCH_SIZE)).fetchone()[0]
+                if upper is None:
+                    break
+                cursor.execute('''
+                INSERT OR IGNORE INTO ban_nickname_words_new (word, added_by, created_at)
+                SELECT word, NULL, COALESCE(created_at, CURRENT_TIMESTAMP) 
+                FROM ban_nickname_words
+                WHERE rowid > ? AND rowid <= ?
+                ORDER BY rowid
+                ''', (last_rowid, upper))
+                cursor.execute('COMMIT')
+                last_rowid = upper
             
-            # Drop old table and rename new one
+            # Drop old table and rename new one (still inside the last BEGIN EXCLUSIVE)
             cursor.execute('DROP TABLE IF EXISTS ban_nickname_words_old')
             cursor.execute('ALTER TABLE ban_nickname_words RENAME TO ban_nickname_words_old')
             cursor.execute('ALTER TABLE ban_nickname_words_new RENAME TO ban_nickname_words')
             
-            # Create indexes
+            # Create indexes only after the bulk copy
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_ban_nickname_words_chat_word ON ban_nickname_words(chat_id, word)')
             
+            cursor.execute('COMMIT')
             logger.info("Successfully migrated ban_nickname_words table")
         
-        # Commit changes
-        conn.commit()
         logger.info("Database migration completed successfully")
         
     except Exception as e:
         logger.error(f"Error during migration: {e}")
-        if 'conn' in locals() and conn:
+        if 'conn' in locals() and conn and conn.in_transaction:
             conn.rollback()
         raise
     finally:
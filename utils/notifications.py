@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from telegram import User, Chat, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
@@ -31,10 +32,16 @@ async def propose_global_ban(
     ]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
+    # Send to all admins concurrently: total latency is one round-trip, not one per admin
+    results = await asyncio.gather(
+        *(
+            context.bot.send_message(
                 chat_id=admin_id, text=text, parse_mode=ParseMode.HTML, reply_markup=reply_markup
             )
-        except Exception as e:
-            logger.error(f"Failed to send global ban proposal to admin {admin_id}: {e}")
\ No newline at end of file
+            for admin_id in ADMIN_IDS
+        ),
+        return_exceptions=True,
+    )
+    for admin_id, result in zip(ADMIN_IDS, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to send global ban proposal to admin {admin_id}: {result}")
@@ -1,4 +1,5 @@
 import unicodedata
+from functools import lru_cache
 
 def normalize_text(text: str) -> str:
     """
@@ -6,32 +7,75 @@ def normalize_text(text: str) -> str:
     """
     if not text:
         return ""
-    return " ".join(text.lower().split())
+    # Fast path: isprintable() is False for every whitespace char except the ASCII space,
+    # so single-spaced text without edge spaces has nothing to collapse.
+    # islower() stops at the first uppercase char; already-lowercase text is not copied
+    lowered = text if text.islower() else text.lower()
+    if text.isprintable() and "  " not in text and text[0] != " " and text[-1] != " ":
+        return lowered
+    return " ".join(lowered.split())
+
+# Все комбинируемые знаки (категории Mn, Mc, Me), собранные один раз при импорте.
+# Вне этих диапазонов (U+0300..U+1FFFF и плоскость 14) таких знаков нет.
+_COMBINING_MARKS = frozenset(
+    char
+    for block in (range(0x300, 0x20000), range(0xE0000, 0xE1000))
+    for char in map(chr, block)
+    if unicodedata.category(char) in ('Mn', 'Mc', 'Me')
+)
+
+# Символы, после NFD дающие хотя бы один такой знак: сами знаки и составные
+# символы вроде 'é' или 'й'. Составных символов с такими знаками выше U+1FFFF нет.
+_MARK_SOURCES = _COMBINING_MARKS | frozenset(
+    char
+    for char in map(chr, range(0xC0, 0x20000))
+    if unicodedata.decomposition(char)
+    and not _COMBINING_MARKS.isdisjoint(unicodedata.normalize('NFD', char))
+)
+
+# Длиннее этого текст не кэшируется: ключ до 256 символов занимает не больше ~1 КБ
+# (4 байта на символ вне BMP), так что 8192 записи _is_zalgo_cached укладываются в ~10 МБ.
+# Повторяющийся спам обычно короткий, длинный текст просто проверяется заново.
+ZALGO_CACHE_MAX_LEN = 256
 
 def is_zalgo_text(text: str, min_diacritics: int, ratio_threshold: float) -> bool:
+    """
+    Проверяет, является ли текст Zalgo (см. _is_zalgo_impl).
+    Вердикт кэшируется: повторяющийся спам проверяется одним поиском в словаре.
+    """
+    if not text or not isinstance(text, str):
+        return False
+
+    # В ASCII нет комбинированных знаков, а NFD его не меняет: это обычный случай.
+    # При min_diacritics <= 0 вердикт зависит только от ratio_threshold, поэтому считаем честно
+    if min_diacritics > 0 and text.isascii():
+        return False
+
+    # Текст без источников знаков (обычная кириллица без 'й'/'ё', CJK) не нужно нормализовать
+    if min_diacritics > 0 and _MARK_SOURCES.isdisjoint(text):
+        return False
+
+    if len(text) > ZALGO_CACHE_MAX_LEN:
+        return _is_zalgo_impl(text, min_diacritics, ratio_threshold)
+    return _is_zalgo_cached(text, min_diacritics, ratio_threshold)
+
+def _is_zalgo_impl(text: str, min_diacritics: int, ratio_threshold: float) -> bool:
     """
     Проверяет, является ли текст Zalgo, анализируя количество и соотношение
     комбинированных диакритических знаков к базовым символам.
     Текст считается Zalgo, если он превышает и минимальное количество, и пороговое соотношение.
     """
-    if not text:
-        return False
-
     # NFD-нормализация разделяет символы типа 'é' на 'e' и '´'.
     # Это дает более точный подсчет базовых символов и диакритических знаков.
-    try:
-        normalized_text = unicodedata.normalize('NFD', text)
-    except TypeError:
+    normalized_text = unicodedata.normalize('NFD', text)
+
+    # Знаков не может быть больше, чем символов: короткий текст не требует подсчета
+    if len(normalized_text) < min_diacritics:
         return False
 
-    diacritics_count = 0
-    base_chars_count = 0
-    for char in normalized_text:
-        # Проверяем по самым распространенным Unicode категориям для комбинированных символов
-        if unicodedata.category(char) in ('Mn', 'Mc', 'Me'):
-            diacritics_count += 1
-        else:
-            base_chars_count += 1
+    # Подсчет в C через map вместо вызова unicodedata.category для каждого символа
+    diacritics_count = sum(map(_COMBINING_MARKS.__contains__, normalized_text))
+    base_chars_count = len(normalized_text) - diacritics_count
 
     if diacritics_count < min_diacritics:
         return False
@@ -41,4 +85,6 @@ def is_zalgo_text(text: str, min_diacritics: int, ratio_threshold: float) -> boo
 
     ratio = diacritics_count / base_chars_count
     
-    return ratio >= ratio_threshold
\ No newline at end of file
+    return ratio >= ratio_threshold
+
+_is_zalgo_cached = lru_cache(maxsize=8192)(_is_zalgo_impl)